@@ -0,0 +1,59 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # No window needed
+import pygame
+
+STORY_COUNTS = [100, 1000, 5000]
+MAP_X, MAP_Y, MAP_WIDTH, MAP_HEIGHT = -2920, -2580, 6530, 9796  # The Map entity of AppEngine.start
+STAR_PATH = "../assets/star.png"
+
+
+def texture_memory(textures):
+    """
+    Bytes of the distinct surfaces in textures, a surface shared by many entities counts once.
+    """
+    distinct = {id(texture): texture for texture in textures}
+    return len(distinct), sum(texture.get_pitch() * texture.get_height() for texture in distinct.values())
+
+
+def own_textures(count):
+    """
+    Every story loading and scaling its own star, as GameObject did.
+    """
+    return [pygame.transform.scale(pygame.image.load(STAR_PATH), (100, 100)) for _ in range(count)]
+
+
+def shared_textures(count):
+    from Client_side.App.Story import Story
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [Story(MAP_X + random.randrange(MAP_WIDTH), MAP_Y + random.randrange(MAP_HEIGHT), 100, 100,
+                      (255, 0, 0), "Story").texture for _ in range(count)]
+
+
+def report(name, make, count):
+    start = time.perf_counter()
+    textures = make(count)
+    elapsed = time.perf_counter() - start
+    surfaces, size = texture_memory(textures)
+    print(f"  {name:22} {elapsed * 1000:9.1f} ms   {surfaces:6} surfaces   {size / 1024:10.1f} KB")
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    # The entities load "../font.ttf" and "../assets/..." like the client, which runs from Client_side
+    os.chdir(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Client_side'))
+    pygame.init()
+    pygame.display.set_mode((1280, 720))
+
+    from Client_side.App.AssetManager import assets
+    for count in STORY_COUNTS:
+        print(f"stories={count}")
+        report("own texture per story", own_textures, count)
+        report("asset manager", shared_textures, count)
+    print("asset manager:", assets.stats())
@@ -0,0 +1,65 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Server_side import SqlDataBase, WorkerPool
+
+USER_COUNT = 20
+FLOOD_SIZES = [8, 32, 128, 512]  # Logins sent at the same moment
+POOL_SIZES = [(2, 32), (4, 32), (4, 128)]  # (workers, max_pending), the first one is the server's default
+
+
+def make_users(db_name):
+    with contextlib.redirect_stdout(io.StringIO()):
+        data_base = SqlDataBase.SqlDataBase(db_name=db_name)
+        for i in range(USER_COUNT):
+            data_base.create_user(f"first{i}", f"user{i}", f"password{i}")
+    return data_base
+
+
+def flood(data_base, workers, max_pending, num_logins):
+    """
+    One thread per login, all submitting to the pool at once like that many connection threads would.
+    Returns the logins served per second, the refused ones and the worst wait of a served login.
+    """
+    pool = WorkerPool.WorkerPool(workers, max_pending, 'auth')
+    barrier = threading.Barrier(num_logins)
+    waits = []
+    waits_lock = threading.Lock()
+
+    def client(index):
+        user = index % USER_COUNT
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            future = pool.submit(data_base.check_credentials, f"user{user}", f"password{user}")
+        except WorkerPool.PoolFull:
+            return
+        future.result()
+        with waits_lock:
+            waits.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(num_logins)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    pool.executor.shutdown()
+    return len(waits) / elapsed, pool.rejected, max(waits)
+
+
+if __name__ == "__main__":
+    data_base = make_users(os.path.join(tempfile.mkdtemp(), 'users.db'))
+    for workers, max_pending in POOL_SIZES:
+        for num_logins in FLOOD_SIZES:
+            rate, rejected, worst_wait = flood(data_base, workers, max_pending, num_logins)
+            print(f"workers={workers} max_pending={max_pending:4} flood={num_logins:4}  "
+                  f"served: {rate:7.0f} logins/s  refused: {rejected:4}  worst wait: {worst_wait * 1000:7.0f} ms")
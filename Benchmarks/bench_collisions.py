@@ -0,0 +1,74 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # No window needed
+import pygame
+
+STORY_COUNTS = [1000, 5000, 10000]
+MAP_X, MAP_Y, MAP_WIDTH, MAP_HEIGHT = -2920, -2580, 6530, 9796  # The Map entity of AppEngine.start
+FRAMES = 500
+
+
+def add_stories(registry, count):
+    from Client_side.App.Story import Story
+    with contextlib.redirect_stdout(io.StringIO()):
+        for story_id in range(len(registry.stories) + 1, count + 1):
+            story = Story(MAP_X + random.randrange(MAP_WIDTH), MAP_Y + random.randrange(MAP_HEIGHT), 100, 100,
+                          (255, 0, 0), f"Story {story_id}")
+            registry.add_story(story_id, story)
+
+
+def every_story(registry, player):
+    """
+    collide_handle as it was: every story, with a new Rect for the player and the story each time.
+    """
+    colliding = None
+    for story in registry.stories.values():
+        if player.get_rect().colliderect(story.get_rect()):
+            colliding = story
+    return colliding
+
+
+def near_stories(registry, player):
+    colliding = None
+    for story in registry.stories_colliding(player.get_rect()):
+        colliding = story
+    return colliding
+
+
+def run(registry, player, collide):
+    """
+    Microseconds per frame of a player walking across the map, and the frames it touched a story in.
+    """
+    hits = 0
+    start = time.perf_counter()
+    for frame in range(FRAMES):
+        player.x = MAP_X + MAP_WIDTH * frame // FRAMES
+        player.y = MAP_Y + MAP_HEIGHT * frame // FRAMES
+        if collide(registry, player) is not None:
+            hits += 1
+    return (time.perf_counter() - start) / FRAMES * 1e6, hits
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    # The entities load "../font.ttf" and "../assets/..." like the client, which runs from Client_side
+    os.chdir(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Client_side'))
+    pygame.init()
+    pygame.display.set_mode((1280, 720))
+
+    from Client_side.App.EntityRegistry import EntityRegistry
+    from Client_side.App.Player import Player
+    registry = EntityRegistry()
+    player = Player(0, 0, "")
+    for count in STORY_COUNTS:
+        add_stories(registry, count)
+        every_us, every_hits = run(registry, player, every_story)
+        near_us, near_hits = run(registry, player, near_stories)
+        print(f"stories={count:6}  every story: {every_us:9.1f} us/frame ({every_hits} hits)   "
+              f"spatial grid: {near_us:6.1f} us/frame ({near_hits} hits)")
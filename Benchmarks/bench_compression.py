@@ -0,0 +1,97 @@
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Shared import Compression
+
+STORY_COUNT = 10000
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Server_side', 'data.json')
+REPEAT = 5
+
+
+def make_corpus():
+    """
+    Scale data.json up: every synthetic story is built from the words of the real ones.
+    """
+    with open(DATA_FILE, 'r', encoding='utf-8') as file:
+        stories = json.load(file)
+    words = [word for story in stories for word in (story['title'] + ' ' + story['content']).split()]
+    usernames = [story['username'] for story in stories]
+    return [{
+        "id": i,
+        "title": ' '.join(random.choices(words, k=random.randint(1, 4))),
+        "content": ' '.join(random.choices(words, k=random.randint(10, 80))),
+        "username": random.choice(usernames),
+        "pos_x": random.randrange(6530),
+        "pos_y": random.randrange(9796)
+    } for i in range(1, STORY_COUNT + 1)]
+
+
+def response(stories, ensure_ascii):
+    """
+    The JSON receive_stories response of these stories.
+    """
+    return json.dumps({
+        "ids": [story['id'] for story in stories],
+        "titles": [story['title'] for story in stories],
+        "contents": [story['content'] for story in stories],
+        "usernames": [story['username'] for story in stories],
+        "pos_x": [story['pos_x'] for story in stories],
+        "pos_y": [story['pos_y'] for story in stories]
+    }, ensure_ascii=ensure_ascii).encode('utf-8')
+
+
+def measure(function, data):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = function(data)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name, bodies, codec):
+    """
+    Bytes and compression / decompression time per fetch of each body.
+    """
+    size = compress_time = decompress_time = 0
+    for body in bodies:
+        if codec is None:
+            size += len(body)
+            continue
+        elapsed, compressed = measure(codec.compress, body)
+        compress_time += elapsed
+        size += len(compressed)
+        decompress_time += measure(codec.decompress, compressed)[0]
+    count = len(bodies)
+    print(f"  {name:26} {size / count:12.0f} bytes   compress {compress_time / count * 1e6:9.1f} us   "
+          f"decompress {decompress_time / count * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    stories = make_corpus()
+    dictionary = Compression.train_dictionary([story['title'] + '\n' + story['content'] for story in stories])
+
+    codecs = [("zlib", Compression.ZlibCodec())]
+    if Compression.zstandard:
+        codecs.append(("zstd", Compression.ZstdCodec()))
+        codecs.append(("zstd + dictionary", Compression.ZstdCodec(dictionary)))
+    else:
+        print("zstandard is not installed, only zlib is measured")
+
+    fetches = [
+        ("full snapshot", [stories]),
+        ("page of 200 stories", [stories[i:i + 200] for i in range(0, 2000, 200)]),
+        ("single story (event)", [[story] for story in stories[:200]]),
+    ]
+    for fetch_name, fetch_stories in fetches:
+        print(f"{fetch_name} ({STORY_COUNT} stories in the store)")
+        report("json \\u escapes", [response(page, True) for page in fetch_stories], None)
+        utf8_bodies = [response(page, False) for page in fetch_stories]
+        report("json utf-8", utf8_bodies, None)
+        for name, codec in codecs:
+            report(f"json utf-8 + {name}", utf8_bodies, codec)
@@ -0,0 +1,79 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from cryptography.hazmat.primitives import hashes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Shared import Protocol
+
+HOST = '127.0.0.1'
+CLIENT_COUNTS = [100, 500, 1000, 2000]
+HOLD_TIME = 1.0  # Seconds every client keeps its connection open after being served
+TIMEOUT = 10.0
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+
+def run_server(port, udp_port, backlog, use_asyncio):
+    """
+    Start a Server in its own working directory with its output silenced.
+    """
+    from Server_side.Server import Server
+    os.chdir(tempfile.mkdtemp())
+    sys.stdout = open(os.devnull, 'w')
+    Server(HOST, port, udp_port, backlog=backlog, use_asyncio=use_asyncio)
+
+
+async def fake_client(port):
+    """
+    Connect, exchange keys, fetch the stories and keep the connection open for a while.
+    """
+    reader, writer = await asyncio.open_connection(HOST, port)
+    connection = Protocol.AsyncFramedStream(reader, writer)
+    try:
+        await connection.send_bytes(b'')  # Key request
+        server_key = load_pem_public_key(await connection.recv_bytes())
+        session_key = Protocol.make_session_key()
+        await connection.send_bytes(server_key.encrypt(session_key, OAEP))
+        connection.start_session(session_key)
+        await connection.recv_bytes()  # Session ticket
+        await connection.send_request(1, 'receive_stories', None)
+        await connection.recv_response()
+        await asyncio.sleep(HOLD_TIME)
+    finally:
+        connection.close()
+
+
+async def load(port, num_clients):
+    """
+    Run num_clients concurrent clients, returns how many were served and the elapsed time.
+    """
+    start = time.perf_counter()
+    tasks = [asyncio.wait_for(fake_client(port), TIMEOUT) for _ in range(num_clients)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    served = sum(1 for result in results if not isinstance(result, BaseException))
+    return served, time.perf_counter() - start
+
+
+def bench(name, port, udp_port, backlog, use_asyncio):
+    process = multiprocessing.Process(target=run_server, args=(port, udp_port, backlog, use_asyncio), daemon=True)
+    process.start()
+    time.sleep(1.5)  # Give the server time to generate its keys and start listening
+    try:
+        for num_clients in CLIENT_COUNTS:
+            served, elapsed = asyncio.run(load(port, num_clients))
+            print(f"{name:10} clients={num_clients:5} served={served:5} time={elapsed:6.2f}s")
+    finally:
+        process.terminate()
+        process.join()
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        bench("threaded", 56001, 56002, 5, False)
+        bench("asyncio", 56003, 56004, 1024, True)
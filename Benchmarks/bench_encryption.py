@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives import hashes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Shared import Protocol
+
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+RSA_CHUNK = 190  # Largest plaintext RSA-2048 OAEP-SHA256 can encrypt
+DURATION = 2.0
+
+
+def rate(function, amount=1):
+    """
+    Call function repeatedly for DURATION seconds, returns amount processed per second.
+    """
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        function()
+        count += 1
+    return count * amount / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_key = private_key.public_key()
+    credentials = b"some_user,some_password"
+
+    # Old scheme: every login/register is an RSA-OAEP encrypt on the client and decrypt on the server
+    def rsa_login():
+        private_key.decrypt(public_key.encrypt(credentials, OAEP), OAEP)
+
+    # New scheme: one RSA round for the session key, then AES-GCM for the credentials
+    def session_handshake():
+        session_key = Protocol.make_session_key()
+        client = Protocol.SessionCipher(session_key)
+        server = Protocol.SessionCipher(private_key.decrypt(public_key.encrypt(session_key, OAEP), OAEP), server=True)
+        server.decrypt(Protocol.REQUEST, client.encrypt(Protocol.REQUEST, credentials))
+
+    print(f"RSA per message:  {rate(rsa_login):10.0f} logins/s")
+    print(f"Hybrid session:   {rate(session_handshake):10.0f} handshakes/s")
+
+    # Bulk throughput, RSA has to split the payload in 190 byte chunks
+    payload = os.urandom(64 * 1024)
+    chunks = [payload[i:i + RSA_CHUNK] for i in range(0, len(payload), RSA_CHUNK)]
+
+    def rsa_bulk():
+        for chunk in chunks:
+            private_key.decrypt(public_key.encrypt(chunk, OAEP), OAEP)
+
+    session_key = Protocol.make_session_key()
+    client = Protocol.SessionCipher(session_key)
+    server = Protocol.SessionCipher(session_key, server=True)
+
+    def aes_bulk():
+        client.decrypt(Protocol.RESPONSE, server.encrypt(Protocol.RESPONSE, payload))
+
+    print(f"RSA per message:  {rate(rsa_bulk, len(payload)) / 1e6:10.2f} MB/s")
+    print(f"AES-GCM session:  {rate(aes_bulk, len(payload)) / 1e6:10.2f} MB/s")
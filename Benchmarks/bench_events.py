@@ -0,0 +1,110 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from cryptography.hazmat.primitives import hashes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Shared import Protocol
+
+HOST = '127.0.0.1'
+SUBSCRIBERS = 1000
+EVENTS = 20  # Stories added one after the other, each one is pushed to every subscriber
+EVENT_INTERVAL = 0.1
+TIMEOUT = 30.0
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+
+def run_server(port, udp_port, use_asyncio):
+    """
+    Start a Server in its own working directory with its output silenced.
+    """
+    from Server_side.Server import Server
+    os.chdir(tempfile.mkdtemp())
+    sys.stdout = open(os.devnull, 'w')
+    Server(HOST, port, udp_port, backlog=1024, use_asyncio=use_asyncio)
+
+
+async def open_session(port):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    connection = Protocol.AsyncFramedStream(reader, writer)
+    await connection.send_bytes(b'')  # Key request
+    server_key = load_pem_public_key(await connection.recv_bytes())
+    session_key = Protocol.make_session_key()
+    await connection.send_bytes(server_key.encrypt(session_key, OAEP))
+    connection.start_session(session_key)
+    await connection.recv_bytes()  # Session ticket
+    return connection
+
+
+async def subscriber(port, ready, arrivals):
+    """
+    Subscribe to the story events and record when each of the benchmark's stories arrives.
+    """
+    connection = await open_session(port)
+    try:
+        await connection.send_request(1, 'subscribe', None)
+        await connection.recv_response()
+        ready.release()
+        received = 0
+        while received < EVENTS:
+            msg_type, body = await connection.recv_message()
+            if msg_type == Protocol.EVENT:
+                _, payload = Protocol.unpack_event(body)
+                arrivals[int(payload['titles'][0])].append(time.perf_counter())
+                received += 1
+    finally:
+        connection.close()
+
+
+async def load(port):
+    """
+    Connect the subscribers, then add EVENTS stories from another connection.
+    Returns for every story the time until the last subscriber received it.
+    """
+    ready = asyncio.Semaphore(0)
+    arrivals = [[] for _ in range(EVENTS)]
+    tasks = [asyncio.create_task(asyncio.wait_for(subscriber(port, ready, arrivals), TIMEOUT))
+             for _ in range(SUBSCRIBERS)]
+    for _ in range(SUBSCRIBERS):
+        await ready.acquire()
+
+    writer = await open_session(port)
+    sent = []
+    for i in range(EVENTS):
+        sent.append(time.perf_counter())
+        story = {"title": str(i), "content": "bench", "username": "bench", "pos_x": i, "pos_y": i}
+        await writer.send_request(i + 1, 'add_story', story)
+        await writer.recv_response()
+        await asyncio.sleep(EVENT_INTERVAL)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    writer.close()
+
+    failed = sum(1 for result in results if isinstance(result, BaseException))
+    return [max(times) - start for times, start in zip(arrivals, sent) if times], failed
+
+
+def bench(name, port, udp_port, use_asyncio):
+    process = multiprocessing.Process(target=run_server, args=(port, udp_port, use_asyncio), daemon=True)
+    process.start()
+    time.sleep(1.5)  # Give the server time to generate its keys and start listening
+    try:
+        latencies, failed = asyncio.run(load(port))
+        print(f"{name:10} subscribers={SUBSCRIBERS} events={len(latencies)} failed={failed}  "
+              f"time to reach every subscriber: median {statistics.median(latencies) * 1000:7.1f} ms  "
+              f"max {max(latencies) * 1000:7.1f} ms")
+    finally:
+        process.terminate()
+        process.join()
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        bench("threaded", 56011, 56012, False)
+        bench("asyncio", 56013, 56014, True)
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Server_side import SqlDataBase
+
+# Every login hashes with scrypt now, a few dozen of them are enough to see the scaling
+USER_COUNT = 50
+LOGINS_PER_THREAD = 10
+THREAD_COUNTS = [1, 2, 4, 8]
+
+
+class SharedCursorDataBase:
+    """
+    SqlDataBase as it was: one connection and one cursor shared by every thread.
+    Without the lock concurrent logins on the shared cursor crash the interpreter. The password is checked
+    against the same rows as SqlDataBase, so the two only differ in how they reach the database.
+    """
+
+    def __init__(self, db_name):
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        self.lock = threading.Lock()
+
+    def check_credentials(self, username, password):
+        try:
+            with self.lock:
+                self.cursor.execute('SELECT * FROM users WHERE username=?', (username,))
+                result = self.cursor.fetchone()
+            if result and SqlDataBase.verify_password(password, result[1]):
+                print("t")
+                return True
+        except Exception:
+            pass
+        return False
+
+
+def make_users(db_name):
+    with contextlib.redirect_stdout(io.StringIO()):
+        data_base = SqlDataBase.SqlDataBase(db_name=db_name)
+        for i in range(USER_COUNT):
+            data_base.create_user(f"first{i}", f"user{i}", f"password{i}")
+
+
+def run(data_base, num_threads):
+    """
+    Every thread logs in LOGINS_PER_THREAD times, returns logins per second and the failed ones.
+    """
+    failures = [0] * num_threads
+
+    def worker(index):
+        for i in range(LOGINS_PER_THREAD):
+            user = (index * 7919 + i) % USER_COUNT
+            if not data_base.check_credentials(f"user{user}", f"password{user}"):
+                failures[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(num_threads)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    return num_threads * LOGINS_PER_THREAD / elapsed, sum(failures)
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    db_name = os.path.join(directory, 'users.db')
+    make_users(db_name)
+
+    shared = SharedCursorDataBase(db_name)
+    with contextlib.redirect_stdout(io.StringIO()):
+        per_thread = SqlDataBase.SqlDataBase(db_name=db_name)
+    for num_threads in THREAD_COUNTS:
+        shared_rate, shared_failures = run(shared, num_threads)
+        rate, failures = run(per_thread, num_threads)
+        print(f"threads={num_threads:3}  shared cursor: {shared_rate:9.0f} logins/s ({shared_failures} failed)   "
+              f"per-thread connections: {rate:9.0f} logins/s ({failures} failed)")
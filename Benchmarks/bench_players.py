@@ -0,0 +1,68 @@
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Server_side.Server import Server
+from Server_side import PlayerRegistry
+from Server_side.Server import VIEW_WIDTH, VIEW_HEIGHT
+from Shared import Snapshot
+
+PLAYER_COUNTS = [100, 1000, 10000]
+MAP_WIDTH, MAP_HEIGHT = 6530, 9796
+SAMPLE = 200  # Updates timed per tick, the tick cost is extrapolated to every player
+
+
+def all_players_payload(players):
+    """
+    What the server sent before interest management: every player to every client.
+    """
+    return {
+        "num_players": len(players),
+        "players": [{"username": name, "pos_x": x, "pos_y": y} for name, (x, y) in players.items()]
+    }
+
+
+def make_server():
+    """
+    A Server with only the player state, without sockets or databases.
+    """
+    server = Server.__new__(Server)
+    server.players = PlayerRegistry.PlayerRegistry()
+    return server
+
+
+def bench(num_players):
+    positions = {f"player{i}": (random.randrange(MAP_WIDTH), random.randrange(MAP_HEIGHT))
+                 for i in range(num_players)}
+    server = make_server()
+    for username, (x, y) in positions.items():
+        server.update_player(username, x, y)
+
+    sample = random.sample(list(positions), min(SAMPLE, num_players))
+    scale = num_players / len(sample)
+
+    start = time.perf_counter()
+    full_bytes = sum(len(json.dumps(all_players_payload(positions)).encode('utf-8')) for _ in sample)
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    view_bytes = 0
+    for username in sample:
+        x, y = positions[username]
+        server.update_player(username, x + 5, y + 5)
+        players = {name: (px, py) for name, px, py in server.players.in_view(x + 5, y + 5, VIEW_WIDTH, VIEW_HEIGHT)}
+        view_bytes += len(Snapshot.pack_delta(1, 0, {}, players))
+    view_time = time.perf_counter() - start
+
+    print(f"players={num_players:6}  all players: {full_time * scale * 1000:9.1f} ms/tick "
+          f"{full_bytes * scale / 1e6:10.2f} MB/tick   in view: {view_time * scale * 1000:9.1f} ms/tick "
+          f"{view_bytes * scale / 1e6:8.3f} MB/tick")
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    for count in PLAYER_COUNTS:
+        bench(count)
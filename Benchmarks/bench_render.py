@@ -0,0 +1,67 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # No window needed
+import pygame
+
+STORY_COUNT = 10000
+MAP_X, MAP_Y, MAP_WIDTH, MAP_HEIGHT = -2920, -2580, 6530, 9796  # The Map entity of AppEngine.start
+WIDTH, HEIGHT = 1280, 720
+FRAMES = 200
+
+
+def make_stories(registry):
+    from Client_side.App.Story import Story
+    with contextlib.redirect_stdout(io.StringIO()):
+        for story_id in range(1, STORY_COUNT + 1):
+            story = Story(MAP_X + random.randrange(MAP_WIDTH), MAP_Y + random.randrange(MAP_HEIGHT), 100, 100,
+                          (255, 0, 0), f"Story {story_id}")
+            registry.add_story(story_id, story)
+
+
+def camera_path():
+    """
+    The camera following a player walking across the map.
+    """
+    camera = pygame.Rect(0, 0, WIDTH, HEIGHT)
+    for frame in range(FRAMES):
+        camera.center = (MAP_X + MAP_WIDTH * frame // FRAMES, MAP_Y + MAP_HEIGHT * frame // FRAMES)
+        yield camera
+
+
+def run(screen, stories_of):
+    """
+    Render the stories of every frame, returns milliseconds per frame and stories drawn per frame.
+    """
+    drawn = 0
+    start = time.perf_counter()
+    for camera in camera_path():
+        screen.fill((30, 30, 30))
+        for story in stories_of(camera):
+            story.render(screen, camera)
+            drawn += 1
+    elapsed = time.perf_counter() - start
+    return elapsed / FRAMES * 1000, drawn / FRAMES
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    # The entities load "../font.ttf" and "../Assets/..." like the client, which runs from Client_side
+    os.chdir(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Client_side'))
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+
+    from Client_side.App.EntityRegistry import EntityRegistry
+    registry = EntityRegistry()
+    make_stories(registry)
+
+    every_ms, every_drawn = run(screen, lambda camera: registry.stories.values())
+    culled_ms, culled_drawn = run(screen, registry.visible_stories)
+    print(f"{STORY_COUNT} stories, {WIDTH}x{HEIGHT} camera on a {MAP_WIDTH}x{MAP_HEIGHT} map")
+    print(f"  every story:     {every_ms:8.2f} ms/frame   {every_drawn:8.0f} render calls/frame")
+    print(f"  camera culling:  {culled_ms:8.2f} ms/frame   {culled_drawn:8.0f} render calls/frame")
@@ -0,0 +1,76 @@
+import json
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Server_side.PlayerRegistry import PlayerRegistry
+from Server_side.Server import VIEW_WIDTH, VIEW_HEIGHT
+from Shared import Snapshot
+
+PLAYER_COUNTS = [10, 100, 1000, 5000]
+MAP_WIDTH, MAP_HEIGHT = 6530, 9796
+MOVING = 0.2  # Share of the players that move between two snapshots
+VIEWERS = 200  # Players whose packets are measured
+
+
+def json_snapshot(players):
+    """
+    The JSON snapshot of every player the server used to send.
+    """
+    return json.dumps({
+        "num_players": len(players),
+        "players": [{"username": name, "pos_x": x, "pos_y": y} for name, (x, y) in players.items()]
+    }).encode('utf-8')
+
+
+def view_of(registry, entry):
+    """
+    The players broadcast_players puts in a client's snapshot before cutting it to one datagram.
+    """
+    return {username: (int(x), int(y)) for username, x, y in
+            registry.in_view(entry.pos_x, entry.pos_y, VIEW_WIDTH, VIEW_HEIGHT)}
+
+
+def bench(num_players):
+    registry = PlayerRegistry()
+    for i in range(num_players):
+        registry.update(f"player{i}", random.randrange(MAP_WIDTH), random.randrange(MAP_HEIGHT))
+    viewers = random.sample(registry.snapshot(), min(VIEWERS, num_players))
+    everyone = {entry.username: (entry.pos_x, entry.pos_y) for entry in registry.snapshot()}
+
+    # Tick 1: no baseline yet, every viewer gets a full snapshot of its view
+    baselines = {}
+    full_sizes, in_view, sent = [], [], []
+    for entry in viewers:
+        players = view_of(registry, entry)
+        packet, baselines[entry.username] = Snapshot.pack_view(1, 0, {}, players, entry.pos_x, entry.pos_y)
+        full_sizes.append(len(packet))
+        in_view.append(len(players))
+        sent.append(len(baselines[entry.username]))
+
+    for entry in random.sample(registry.snapshot(), int(num_players * MOVING)):
+        registry.update(entry.username, entry.pos_x + random.randint(-20, 20), entry.pos_y + random.randint(-20, 20))
+
+    # Tick 2: deltas from the snapshot each viewer acknowledged
+    delta_sizes = []
+    for entry in viewers:
+        baseline = baselines[entry.username]
+        packet, players = Snapshot.pack_view(2, 1, baseline, view_of(registry, entry), entry.pos_x, entry.pos_y)
+        delta_sizes.append(len(packet))
+        # The client must rebuild exactly the players that were sent
+        _, baseline_sequence, changed, removed = Snapshot.unpack_delta(packet)
+        assert Snapshot.apply_delta(baseline if baseline_sequence else {}, changed, removed) == players
+
+    assert max(full_sizes + delta_sizes) <= Snapshot.MAX_PACKET_SIZE
+    print(f"players={num_players:5}  json of everyone={len(json_snapshot(everyone)):7} B  "
+          f"in view {statistics.mean(in_view):6.1f}  sent {statistics.mean(sent):5.1f}  "
+          f"full avg {statistics.mean(full_sizes):6.0f} B max {max(full_sizes):5} B  "
+          f"delta avg {statistics.mean(delta_sizes):6.0f} B max {max(delta_sizes):5} B")
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    for count in PLAYER_COUNTS:
+        bench(count)
@@ -0,0 +1,78 @@
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Shared import StoryColumns
+
+STORY_COUNT = 100000
+USERS = 500
+MAP_WIDTH, MAP_HEIGHT = 6530, 9796
+REPEAT = 5
+
+
+def make_entries():
+    return [{
+        "id": i,
+        "title": f"Story {i}",
+        "content": "Once upon a time " * random.randint(1, 8),
+        "username": f"user{random.randrange(USERS)}",
+        "pos_x": random.randrange(MAP_WIDTH),
+        "pos_y": random.randrange(MAP_HEIGHT),
+        "version": i
+    } for i in range(1, STORY_COUNT + 1)]
+
+
+def measure(function):
+    """
+    Best time of REPEAT runs and the result of the last one.
+    """
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def encode_lists(data):
+    """
+    What receive_stories did before: five lists built from the dicts, then json.dumps.
+    """
+    return json.dumps({
+        "titles": [entry['title'] for entry in data],
+        "contents": [entry['content'] for entry in data],
+        "usernames": [entry['username'] for entry in data],
+        "pos_x": [entry['pos_x'] for entry in data],
+        "pos_y": [entry['pos_y'] for entry in data]
+    }).encode('utf-8')
+
+
+def memory_of(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    entries = make_entries()
+
+    dict_memory, data = memory_of(lambda: json.loads(json.dumps(entries)))
+    column_memory, columns = memory_of(lambda: StoryColumns.StoryColumns.from_entries(entries))
+
+    json_time, json_body = measure(lambda: encode_lists(data))
+    column_time, column_body = measure(columns.pack)
+    json_decode, _ = measure(lambda: json.loads(json_body))
+    column_decode, _ = measure(lambda: StoryColumns.unpack(column_body))
+
+    print(f"stories={STORY_COUNT}")
+    print(f"store in memory:  dicts {dict_memory / 1e6:8.1f} MB   columns {column_memory / 1e6:8.1f} MB")
+    print(f"encode snapshot:  json  {json_time * 1000:8.1f} ms   columns {column_time * 1000:8.1f} ms")
+    print(f"snapshot size:    json  {len(json_body) / 1e6:8.2f} MB   columns {len(column_body) / 1e6:8.2f} MB")
+    print(f"decode snapshot:  json  {json_decode * 1000:8.1f} ms   columns {column_decode * 1000:8.1f} ms")
@@ -1,5 +1,7 @@
 import pygame
 from Client_side.App.Button import Button
+from Client_side.App.TextCache import text_cache
+from Client_side.App.AssetManager import assets
 
 
 class AddStory:
@@ -11,11 +13,11 @@ class AddStory:
         self.running = True
         self.story_title = ""
         self.story_content = ""
-        self.font = pygame.font.Font("../font.ttf", 24)
-        self.title_font = pygame.font.Font("../font.ttf", 48)
+        self.font_size = 24
+        self.title_font_size = 48
+        self.font = text_cache.font(self.font_size)
         self.window_width, self.window_height = self.screen.get_size()
-        self.bg_image = pygame.transform.scale(pygame.image.load("../assets/story.png"),
-                                               (self.window_width, self.window_height))
+        self.bg_image = assets.scaled("../assets/story.png", (self.window_width, self.window_height))
 
         # Calculate center positions
         self.input_box_title = pygame.Rect((self.window_width - 500) // 2, self.window_height //  2 - 150, 500, 50)
@@ -85,7 +87,7 @@ class AddStory:
 
         # Title Text (Reverse the Hebrew text if it's in Hebrew)
         title_text = self.reverse_words_and_letters_in_text("הוסף סיפור")
-        title_text = self.title_font.render(title_text, True, (0, 0, 0))
+        title_text = text_cache.render(title_text, self.title_font_size, (0, 0, 0))
         title_rect = title_text.get_rect(center=(self.window_width // 2, self.input_box_title.y - 75))
         self.screen.blit(title_text, title_rect)
 
@@ -158,7 +160,7 @@ class AddStory:
             lines = lines[::-1]
 
         for line in lines:
-            rendered_text = self.font.render(line, True, (0, 0, 0))
+            rendered_text = text_cache.render(line, self.font_size, (0, 0, 0))
             # Check if the line contains Hebrew text
             if any(0x0590 <= ord(char) <= 0x05FF for char in line):
                 # Reverse the order of words for Hebrew text (right-to-left)
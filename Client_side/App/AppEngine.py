@@ -10,6 +10,9 @@ from Client_side.App.StoryWindow import StoryWindow
 from Client_side.App.AddStory import AddStory
 from Client_side.App.User import User
 from Client_side.App.Button import Button
+from Client_side.App.EntityRegistry import EntityRegistry
+from Client_side.App.TextCache import text_cache
+from Client_side.App.AssetManager import assets
 
 class AppEngine:
     def __init__(self, client, status, width=1280, height=720, title="Game Engine"):
@@ -22,7 +25,7 @@ class AppEngine:
         pygame.display.set_caption(title)
         self.clock = pygame.time.Clock()
         self.running = True
-        self.entities = []  # List of game entities
+        self.entities = EntityRegistry()  # Game entities, kept apart by kind
         self.background_color = (30, 30, 30)
         self.bStart = True
         self.player = None
@@ -31,12 +34,10 @@ class AppEngine:
         self.camera_speed = 5  # Speed of camera movement
         self.button_radius = 50  # Button settings
         self.read_more_button_rect = None  # Initialize it safely
-        self.refresh_story = pygame.time.get_ticks()  # Track the last time stories were loaded
-        self.refresh_user = pygame.time.get_ticks()  # Track the last time stories were loaded
-
-    def add_entity(self, entity):
-        """Add an entity to the game"""
-        self.entities.append(entity)
+        self.refresh_user = pygame.time.get_ticks()  # Track the last time the player's position was sent
+        self.player_update_interval = 50  # ms, the server broadcasts positions 20 times per second
+        self.story_margin = 1000  # Stories are loaded this far around the camera
+        self.loaded_region = None  # pygame.Rect of the map the stories were last loaded for
 
     def handle_events(self):
         """Handle events like key presses or mouse clicks"""
@@ -52,17 +53,15 @@ class AppEngine:
         print(f"Mouse clicked at: {mouse_pos}")  # Debugging
 
         # Handle Plus button click
-        for entity in self.entities:
-            if isinstance(entity, Button) and entity.on_click(mouse_pos):
+        for button in self.entities.buttons:
+            if button.on_click(mouse_pos):
 
-                if entity.button_name == "add_story" :
+                if button.button_name == "add_story" :
                     self.add_story_window()
 
-                if entity.button_name == "go_back" :
+                if button.button_name == "go_back" :
                     self.running = False
 
-
-
         # Check 'Read More' button click only if it exists
         if hasattr(self, 'read_more_button') and self.read_more_button.on_click(mouse_pos):
             if self.colliding_entity_info:
@@ -78,8 +77,7 @@ class AppEngine:
     def add_story_window(self):
         """Start the AddStory window for adding new stories"""
         add_story_window = AddStory(self.screen, self.client, self.player.get_rect().x, self.player.get_rect().y)
-        add_story_window.run()
-        self.load_stories()
+        add_story_window.run()  # The new story comes back as a stories_changed event
 
     def render_collision_info(self):
         """Render information about the collision on the screen"""
@@ -107,17 +105,17 @@ class AppEngine:
             # Now draw this surface onto the main screen
             self.screen.blit(info_box_surface, (text_x - info_box_width // 2, text_y - info_box_height // 2))
 
-            # Set up fonts
-            font = pygame.font.Font("../font.ttf", 24)
-            title_font = pygame.font.Font("../font.ttf", 30)
-            from_font = pygame.font.Font("../font.ttf", 20)
+            # Font sizes, the fonts and the rendered lines come from the text cache
+            font_size = 24
+            title_font_size = 30
+            from_font_size = 20
 
             # Get preview text (and truncate if necessary)
             preview = self.colliding_entity_info.get_description()[:35] + "..." if len(
                 self.colliding_entity_info.get_description()) > 100 else self.colliding_entity_info.get_description()
 
             # Wrap and render text
-            self.wrap_text_and_render(preview, font, (text_x, text_y), from_font, title_font)
+            self.wrap_text_and_render(preview, font_size, (text_x, text_y), from_font_size, title_font_size)
 
             # Create the 'Read More' button dynamically
             self.read_more_button = Button("read_more", text_x - 60, text_y + 50, 120, 40, (29, 64, 99), (50, 90, 150),
@@ -125,8 +123,9 @@ class AppEngine:
                                            num_of_side=4)
             self.read_more_button.render(self.screen, self.camera)  # Draw the button
 
-    def wrap_text_and_render(self, preview, font, text_position, from_font, title_font):
+    def wrap_text_and_render(self, preview, font_size, text_position, from_font_size, title_font_size):
         """Wrap text to fit inside the info box and render it"""
+        font = text_cache.font(font_size)
         wrapped_lines = []
         for raw_line in preview.splitlines():
             words = raw_line.split()
@@ -143,14 +142,14 @@ class AppEngine:
         for idx, line in enumerate(wrapped_lines):
             # Use title_font for the first line
             if idx == 0:
-                line_font = from_font # Use larger font for the title or first line
+                line_font_size = from_font_size # Use larger font for the title or first line
             # Use secend_font for the second line
             elif idx == 1:
-                line_font = title_font  # Use a different font for the second line
+                line_font_size = title_font_size  # Use a different font for the second line
             else:
-                line_font = font  # Use the regular font for subsequent lines
+                line_font_size = font_size  # Use the regular font for subsequent lines
 
-            text_surface = line_font.render(line, True, (0, 0, 0))
+            text_surface = text_cache.render(line, line_font_size, (0, 0, 0))
             self.screen.blit(text_surface, (text_position[0] - text_surface.get_width() // 2, line_y))
             line_y += text_surface.get_height() + 5
 
@@ -159,22 +158,23 @@ class AppEngine:
         """Render all entities to the screen"""
         self.screen.fill(self.background_color)
 
-        # Render all entities except the player
-        for entity in self.entities:
-            if entity is not self.player:
-                    entity.render(self.screen, self.camera)
+        # The map, then the stories and the other players on it, only the ones the camera can see
+        for map_entity in self.entities.maps:
+            map_entity.render(self.screen, self.camera)
 
-        for entity in self.entities:
-            if entity is not self.player:
-                if isinstance(entity, Others):
-                    entity.render(self.screen, self.camera)
+        for story in self.entities.visible_stories(self.camera):
+            story.render(self.screen, self.camera)
 
+        for other in self.entities.visible_others(self.camera):
+            other.render(self.screen, self.camera)
+
+        # The buttons are drawn over the world
         is_hover = False
-        for entity in self.entities:
-            if isinstance(entity, Button) and entity.is_hovered:
-                is_hover = True
-                break
-            # Change the cursor to a hand on hover (this will now always be updated in the render)
+        for button in self.entities.buttons:
+            button.render(self.screen, self.camera)
+            is_hover = is_hover or button.is_hovered
+
+        # Change the cursor to a hand on hover (this will now always be updated in the render)
 
         if is_hover or (hasattr(self, 'read_more_button') and self.read_more_button.is_hovered):
             pygame.mouse.set_cursor(pygame.SYSTEM_CURSOR_HAND)
@@ -209,50 +209,85 @@ class AppEngine:
 
         # Load the map
         map_entity = Map(-2920  , -2580,  6530, 9796, "../assets/map.png")
-        self.add_entity(map_entity)
+        self.entities.add_map(map_entity)
         # Create the plus button and player
         add_story_b = Button("add_story", self.width/ 2, self.height - 60, 100, 100, (29, 64, 99), (70, 130, 180), "+", 100 / 2, 0, 75)
-        self.add_entity(add_story_b)
+        self.entities.add_button(add_story_b)
 
         # Create the go back button and player
         go_back_b = Button("go_back",self.width - 200,  60, 150, 75, (29, 64, 99), (34, 72, 115), self.reverse_words_and_letters_in_text(">>יציאה"), 20, 4, 30)
-        self.add_entity(go_back_b)
+        self.entities.add_button(go_back_b)
 
         self.player = Player(100, 100,  self.client.username, 50, 50, (0, 255, 0))  # Player as a green square
-        self.add_entity(self.player)
 
-        # Load and display stories from the client
+        # Let the server push the new stories first, then load the ones already there,
+        # a story added in between arrives as an event instead of being missed
+        self.client.subscribe()
         self.load_stories()
 
     def load_stories(self):
-        """Load and place stories on the map with specific positions"""
+        """Load the stories around the camera, the changes made after that arrive as stories_changed events"""
         try:
-            stories = self.client.receive_stories()
-            print("Stories received:", stories)  # Debugging line
-
+            # Only the stories around the camera, the rest of the map is loaded when the player gets there
+            region = self.camera.inflate(2 * self.story_margin, 2 * self.story_margin)
+            stories = self.client.receive_stories((region.left, region.top, region.right, region.bottom))
             if not stories:
-                print("No stories received.")
                 return
+            self.loaded_region = region
+            # Everything in the new region was received, forget the stories that are not in it
+            ids_in_region = set(stories['ids'])
+            for story_id in [story_id for story_id in self.entities.stories if story_id not in ids_in_region]:
+                self.remove_story(story_id)
 
-            titles, contents, usernames, positions_x, positions_y = stories
-
-            for (title, username, content, x, y) in zip(titles, usernames, contents, positions_x, positions_y):
-                print(f"Adding story at position: ({x}, {y})")  # Debugging print for positions
-                story = Story(x, y, 100, 100, (255, 0, 0),
-                              self.reverse_words_and_letters_in_text(f" מאת: {username}") + "\n"
-                              + self.reverse_words_and_letters_in_text(title) + "\n"
-                              + self.reverse_words_and_letters_in_text(content))
-                self.add_entity(story)
+            self.merge_stories(stories)
 
         except Exception as e:
             print("Error while loading stories:", e)
 
+    def merge_stories(self, stories):
+        """Apply a receive_stories response or a stories_changed event to the stories on the map"""
+        for story_id in stories['deleted']:
+            self.remove_story(story_id)
+
+        for (story_id, title, username, content, x, y) in zip(stories['ids'], stories['titles'],
+                                                               stories['usernames'], stories['contents'],
+                                                               stories['pos_x'], stories['pos_y']):
+            # Skip the stories already on the map, and the ones pushed for a part of the map we have not loaded
+            if story_id in self.entities.stories or not self.loaded_region.collidepoint(x, y):
+                continue
+            print(f"Adding story at position: ({x}, {y})")  # Debugging print for positions
+            story = Story(x, y, 100, 100, (255, 0, 0),
+                          self.reverse_words_and_letters_in_text(f" מאת: {username}") + "\n"
+                          + self.reverse_words_and_letters_in_text(title) + "\n"
+                          + self.reverse_words_and_letters_in_text(content))
+            self.entities.add_story(story_id, story)
+
+    def handle_story_events(self):
+        """Apply the story changes the server pushed since the last frame"""
+        for event, payload in self.client.poll_events():
+            if event == 'stories_changed':
+                self.merge_stories(payload)
+            elif event == 'unsubscribed':
+                # We read the events too slowly (a window was open) and missed some,
+                # subscribe again and reload the region
+                self.client.subscribe()
+                self.loaded_region = None
+                self.load_stories()
+                return
+
+    def remove_story(self, story_id):
+        """Remove a story from the map if it is on it"""
+        story = self.entities.remove_story(story_id)
+        if story is not None and self.colliding_entity_info is story:
+            self.colliding_entity_info = None
+
 
 
     def update(self):
-        """Update all entities in the game"""
-        for entity in self.entities:
-            entity.update()
+        """Update the entities that move, the map, buttons and stories have nothing to update"""
+        self.player.update()
+        for other in self.entities.others.values():
+            other.update()
 
         # Update camera position to follow the player
         self.camera.center = self.player.get_rect().center
@@ -261,30 +296,35 @@ class AppEngine:
 
 
 
-        if current_time - self.refresh_user >= 1:  # 10 seconds
+        if current_time - self.refresh_user >= self.player_update_interval:
             self.create_player()
             self.refresh_user = current_time
 
-        if current_time - self.refresh_story >= 10000:  # 10 seconds
+        # New and deleted stories are pushed by the server, only load when the camera leaves the loaded region
+        if self.loaded_region is None or not self.loaded_region.contains(self.camera):
             self.load_stories()
-            self.refresh_story = current_time
+        else:
+            self.handle_story_events()
 
 
 
     def create_player(self):
         try:
             # Send player data and receive the number of players and their details
-            num_of_players, users = self.client.send_player_data(self.player.x, self.player.y)
+            snapshot = self.client.send_player_data(self.player.x, self.player.y)
+            if snapshot is None:  # No new snapshot from the server since the last update
+                return
+            num_of_players, users = snapshot
             print(f"Number of players: {num_of_players}")
 
             if not users:  # Check if the list of users is empty or invalid
                 print("Warning: No players found in the user list.")
                 return  # Early exit if no users are present
 
-            # First, remove entities that are no longer in the users list
-            usernames_in_users = [user.username for user in users]
-            self.entities = [entity for entity in self.entities if
-                             not (isinstance(entity, Others) and entity.username not in usernames_in_users)]
+            # First, remove the players that are no longer in the users list
+            usernames_in_users = {user.username for user in users}
+            for username in [username for username in self.entities.others if username not in usernames_in_users]:
+                self.entities.remove_other(username)
 
             if num_of_players > 1:
                 for user in users:
@@ -295,20 +335,14 @@ class AppEngine:
                     if user.username != self.client.username:
                         print(f"User {user.username} at position ({user.pos_x}, {user.pos_y})")
 
-                        found = False  # Flag indicating whether the player already exists
-
-                        for entity in self.entities:
-                            if isinstance(entity, Others) and entity.username == user.username:
-                                print(f"Updating {user.username}: pos_x={user.pos_x}, pos_y={user.pos_y}")
-                                entity.x = user.pos_x
-                                entity.y = user.pos_y
-                                found = True
-                                break
-
-                        if not found:
-                            # Add new player to the entities list
+                        other = self.entities.get_other(user.username)
+                        if other is not None:
+                            print(f"Updating {user.username}: pos_x={user.pos_x}, pos_y={user.pos_y}")
+                            self.entities.move_other(other, user.pos_x, user.pos_y)
+                        else:
+                            # Add new player to the entities
                             other = Others(self.player.get_rect().x, self.player.get_rect().y, user.username)
-                            self.entities.append(other)
+                            self.entities.add_other(other)
                             print(f"Added new player: {user.username}")
 
         except Exception as e:
@@ -316,12 +350,11 @@ class AppEngine:
 
 
 
-    def collide_handle(self, entities):
-        """Check for collisions and store collision info for display"""
+    def collide_handle(self):
+        """Check for collisions with the stories near the player and store collision info for display"""
         self.colliding_entity_info = None  # Reset info on each frame
-        for entity in entities:
-            if isinstance(entity, Story) and self.player.get_rect().colliderect(entity.get_rect()):
-                self.colliding_entity_info = entity  # Store the collided entity for rendering info
+        for story in self.entities.stories_colliding(self.player.get_rect()):
+            self.colliding_entity_info = story  # Store the collided entity for rendering info
 
     def run(self, fps=60):
         """Main game loop"""
@@ -333,12 +366,18 @@ class AppEngine:
             while self.running and self.client.running:
                 self.handle_events()
                 self.update()
-                self.collide_handle(self.entities)
+                self.collide_handle()
                 self.render()
                 self.clock.tick(fps)
         except Exception as e:
             print("Unexpected error:", e)
 
+        print("Text cache:", text_cache.stats())
+        print("Assets:", assets.stats())
         self.client.logout()
         self.status[0] = "Log_In"
+        # The shared fonts and surfaces must go before pygame does, the next pygame.init() would reuse them
+        text_cache.clear()
+        assets.clear()
+        self.entities = EntityRegistry()
         pygame.quit()
@@ -0,0 +1,43 @@
+import pygame
+
+
+class AssetManager:
+    """
+    Images scaled once per path and size, shared by every entity that uses them.
+    Only the scaled surfaces are kept, the image as loaded is dropped once scaled (for the map that is
+    the full size source). Once a window is open the scaled images are converted to its pixel format
+    (convert_alpha), so blitting them doesn't convert every pixel on every frame.
+    """
+
+    def __init__(self):
+        self.scaled_images = {}  # (path, (width, height)) -> Surface
+        self.loads = 0
+
+    def load(self, path):
+        """The image at path as loaded, not kept. Raises like pygame.image.load if it can't be loaded"""
+        self.loads += 1
+        return pygame.image.load(path)
+
+    def scaled(self, path, size):
+        """The image at path scaled to size (width, height), the surface is shared and must not be drawn on"""
+        size = (int(size[0]), int(size[1]))
+        key = (path, size)
+        image = self.scaled_images.get(key)
+        if image is None:
+            image = pygame.transform.scale(self.load(path), size)
+            if pygame.display.get_surface() is not None:
+                image = image.convert_alpha()
+            self.scaled_images[key] = image
+        return image
+
+    def clear(self):
+        """Drop every image, before pygame.quit() so none outlives the display it was converted for"""
+        self.scaled_images.clear()
+
+    def stats(self):
+        return {"loads": self.loads, "scaled": len(self.scaled_images),
+                "bytes": sum(surface.get_pitch() * surface.get_height() for surface in self.scaled_images.values())}
+
+
+# Shared by every entity and window of the client
+assets = AssetManager()
@@ -1,12 +1,13 @@
 import pygame
 from Client_side.App.GameObject import GameObject  # Assuming GameObject class is in GameObject.py
+from Client_side.App.TextCache import text_cache
 import math  # To calculate distance for circle hover
 
 class Button(GameObject):
     def __init__(self,button_name,  x, y, width, height, color, hover_color, text, border_radius=None, num_of_side=0, text_size = 24):
         super().__init__(x, y, width, height, color)
         self.button_name= button_name
-        self.font = pygame.font.Font("../font.ttf", text_size)
+        self.font_size = text_size
         self.hover_color = hover_color
         self.text = text
         self.is_hovered = False
@@ -37,7 +38,7 @@ class Button(GameObject):
             pygame.draw.circle(screen, current_color, (self.x, self.y), self.border_radius)
 
         # Render the text inside the button
-        text_surface = self.font.render(self.text, True, (255, 255, 255))  # White text
+        text_surface = text_cache.render(self.text, self.font_size, (255, 255, 255))  # White text
         text_rect = 0
         if self.num_of_side == 4:
             text_rect = text_surface.get_rect(center=pygame.Rect(self.x, self.y, self.width, self.height).center)
@@ -0,0 +1,80 @@
+from Shared import SpatialGrid
+
+# Entities are placed by their top left corner and drawn up to this far from it (texture, username)
+VIEW_MARGIN = 200
+
+
+class EntityRegistry:
+    """
+    The entities of the game, each kind in its own container.
+    Stories are kept by story id and the other players by username, so finding, updating or removing
+    one of them doesn't scan the whole world, and every pass only goes over the kind it needs.
+    Stories and other players are also kept in spatial grids, so a frame only draws the ones near the camera
+    and the player is only tested for collisions with the stories around it.
+    """
+
+    def __init__(self):
+        self.maps = []  # Static background, drawn first
+        self.buttons = []  # UI, drawn in screen coordinates
+        self.stories = {}  # story id -> Story
+        self.others = {}  # username -> Others
+        self.story_grid = SpatialGrid.SpatialGrid()
+        self.max_story_size = 0  # The grid has the corners of the stories, a story this far away can still overlap
+        self.other_grid = SpatialGrid.SpatialGrid()
+
+    def add_map(self, map_entity):
+        self.maps.append(map_entity)
+
+    def add_button(self, button):
+        self.buttons.append(button)
+
+    def add_story(self, story_id, story):
+        self.stories[story_id] = story
+        self.story_grid.insert(story, story.x, story.y)
+        self.max_story_size = max(self.max_story_size, story.width, story.height)
+
+    def remove_story(self, story_id):
+        """Remove a story, returns it or None if it was not there"""
+        story = self.stories.pop(story_id, None)
+        if story is not None:
+            self.story_grid.remove(story)
+        return story
+
+    def add_other(self, other):
+        self.others[other.username] = other
+        self.other_grid.insert(other, other.x, other.y)
+
+    def move_other(self, other, x, y):
+        other.x = x
+        other.y = y
+        self.other_grid.move(other, x, y)
+
+    def remove_other(self, username):
+        other = self.others.pop(username, None)
+        if other is not None:
+            self.other_grid.remove(other)
+        return other
+
+    def get_other(self, username):
+        return self.others.get(username)
+
+    @staticmethod
+    def in_view(grid, camera):
+        return grid.query_rect(camera.left - VIEW_MARGIN, camera.top - VIEW_MARGIN,
+                               camera.right + VIEW_MARGIN, camera.bottom + VIEW_MARGIN)
+
+    def visible_stories(self, camera):
+        """The stories that may show in the camera rect"""
+        return self.in_view(self.story_grid, camera)
+
+    def visible_others(self, camera):
+        """The other players that may show in the camera rect"""
+        return self.in_view(self.other_grid, camera)
+
+    def stories_colliding(self, rect):
+        """The stories overlapping a pygame.Rect, only the grid cells around it are searched"""
+        for story in self.story_grid.query_rect(rect.left - self.max_story_size, rect.top - self.max_story_size,
+                                                rect.right, rect.bottom):
+            # A tuple instead of story.get_rect(), no Rect is made per story
+            if rect.colliderect((story.x, story.y, story.width, story.height)):
+                yield story
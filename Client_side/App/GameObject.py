@@ -1,5 +1,7 @@
 import pygame
 from PIL.ImageOps import scale
+from Client_side.App.TextCache import text_cache
+from Client_side.App.AssetManager import assets
 
 
 class GameObject:
@@ -11,16 +13,15 @@ class GameObject:
         self.color = color
         self.username = username
         self.scale = tex_scale
-        self.font = pygame.font.Font("../font.ttf", 30)
+        self.font_size = 30
 
 
-        # Load texture if provided
+        # Load texture if provided, it is shared with every object using the same image at the same size
         self.texture = None
         if texture_path:
             try:
-                self.texture = pygame.image.load(texture_path)
-                self.texture = pygame.transform.scale(self.texture, (width * tex_scale, height * tex_scale))
-            except pygame.error as e:
+                self.texture = assets.scaled(texture_path, (width * tex_scale, height * tex_scale))
+            except (pygame.error, FileNotFoundError) as e:
                 print(f"Error loading texture: {e}")
                 self.texture = None
 
@@ -38,7 +39,7 @@ class GameObject:
 
         # Draw the username if it exists
         if self.username:
-            text = self.font.render(self.username, True, (255, 255, 255))  # White text
+            text = text_cache.render(self.username, self.font_size, (255, 255, 255))  # White text
             text_rect = text.get_rect(center=(self.x + int(self.width * self.scale) // 2 - camera.x, self.y - 20 - camera.y))
             screen.blit(text, text_rect)
 
@@ -1,11 +1,10 @@
-import pygame
 from Client_side.App.GameObject import GameObject
+from Client_side.App.AssetManager import assets
 
 class Map(GameObject):
     def __init__(self, x, y, width, height, image_path):
         super().__init__(x, y, width, height, (0, 0, 0))  # No color needed since it's an image
-        self.image = pygame.image.load(image_path)
-        self.image = pygame.transform.scale(self.image, (width, height))
+        self.image = assets.scaled(image_path, (width, height))
 
     def render(self, screen, camera):
         # Draw the map relative to the camera position
@@ -4,7 +4,7 @@ from Client_side.App.GameObject import *
 
 class Story(GameObject):
     def __init__(self, x, y, width=40, height=40, color=(255, 0, 0), description="Story Entity"):
-        super().__init__(x, y, width, height, color, "", "../Assets/star.png")
+        super().__init__(x, y, width, height, color, "", "../assets/star.png")
         self.description = description
 
 
@@ -1,5 +1,7 @@
 import pygame
 from Client_side.App.Button import Button  # Assuming the Button class is in Button.py
+from Client_side.App.TextCache import text_cache
+from Client_side.App.AssetManager import assets
 
 
 class StoryWindow:
@@ -9,18 +11,16 @@ class StoryWindow:
         self.window_height = screen.get_height()
         self.full_text = full_text
         self.font_path = font_path
-        self.font = pygame.font.Font(self.font_path, 32)
-        self.small_font = pygame.font.Font(self.font_path, 24)
-        from_font = pygame.font.Font(self.font_path, 26)
-        from_font.set_italic(True)  # Makes the font italic
-        title_font = pygame.font.Font(self.font_path, 40)
-        title_font.set_underline(True)  # Makes the font underlined
+        # Text styles as (size, italic, underline), the fonts are shared through the text cache
+        self.font = (32, False, False)
+        self.small_font = (24, False, False)
+        from_font = (26, True, False)  # Italic
+        title_font = (40, False, True)  # Underlined
         self.wrapped_text = self.wrap_text(full_text, self.font, from_font, title_font)
         self.scroll_y = 200  # Start further down for centering
 
         # Load the background image
-        self.bg_image = pygame.image.load(bg_image_path)
-        self.bg_image = pygame.transform.scale(self.bg_image, (self.window_width, self.window_height))  # Scale it to fit the screen
+        self.bg_image = assets.scaled(bg_image_path, (self.window_width, self.window_height))  # Scale it to fit the screen
 
         # Create the back button using the Button class
         self.back_button = Button(
@@ -57,8 +57,10 @@ class StoryWindow:
                 else:
                     line_font = font  # Use regular font for shorter lines
 
+            size, italic, underline = line_font
+            measure_font = text_cache.font(size, italic=italic, underline=underline, path=self.font_path)
             for word in words:
-                if line_font.size(wrapped_line + word)[
+                if measure_font.size(wrapped_line + word)[
                     0] < self.window_width // 2:  # Adjusted width for better centering
                     wrapped_line += word + " "
                 else:
@@ -97,8 +99,10 @@ class StoryWindow:
 
         # Draw story text (centered)
         y = self.scroll_y
-        for line, line_font in self.wrapped_text:  # Unpack the line and its corresponding font
-            text_surface = line_font.render(line, True, (69, 78, 48))  # Use the correct font for each line
+        for line, (size, italic, underline) in self.wrapped_text:  # Unpack the line and its corresponding font
+            # Use the correct font for each line
+            text_surface = text_cache.render(line, size, (69, 78, 48), italic=italic, underline=underline,
+                                             path=self.font_path)
             text_x = (self.window_width - text_surface.get_width()) // 2  # Center the text
             screen.blit(text_surface, (text_x, y))
             y += text_surface.get_height() + 10
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+import pygame
+
+FONT_PATH = "../font.ttf"
+
+
+class TextCache:
+    """
+    One pygame Font per (path, size, style) and the surfaces of the texts rendered with them.
+    Labels are the same every frame, so after the first frame they are blitted from here instead of
+    being rasterised again. The least recently used surfaces are dropped past max_bytes.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.fonts = {}  # (path, size, bold, italic, underline) -> Font
+        self.surfaces = OrderedDict()  # (text, path, size, color, bold, italic, underline, antialias) -> Surface
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def font(self, size, bold=False, italic=False, underline=False, path=FONT_PATH):
+        """The shared Font of this size and style, loaded on first use"""
+        key = (path, size, bold, italic, underline)
+        font = self.fonts.get(key)
+        if font is None:
+            font = pygame.font.Font(path, size)
+            font.set_bold(bold)
+            font.set_italic(italic)
+            font.set_underline(underline)
+            self.fonts[key] = font
+        return font
+
+    def render(self, text, size, color, bold=False, italic=False, underline=False, path=FONT_PATH, antialias=True):
+        """Font.render of the text, the surface is shared and must not be drawn on"""
+        key = (text, path, size, tuple(color), bold, italic, underline, antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = self.font(size, bold, italic, underline, path).render(text, antialias, color)
+        self.surfaces[key] = surface
+        self.bytes += surface_bytes(surface)
+        # Keep at least the surface just rendered, even if it is bigger than the limit
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.bytes -= surface_bytes(evicted)
+            self.evictions += 1
+        return surface
+
+    def clear(self):
+        """Drop every font and surface, before pygame.quit() so none outlives the font module"""
+        self.fonts.clear()
+        self.surfaces.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "entries": len(self.surfaces), "bytes": self.bytes,
+                "fonts": len(self.fonts)}
+
+
+def surface_bytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+# Shared by every entity and window of the client
+text_cache = TextCache()
@@ -1,47 +1,39 @@
+import base64
 import socket
+import select
 import json
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import serialization
 from Client_side import Engine
 from Client_side.App.User import User
+from Shared import Compression, Keys, Protocol, Snapshot, StoryColumns
 import threading
 
 
 class Client:
-    def __init__(self, server_host='192.168.1.212', tcp_port=65432, udp_port=12345):
+    def __init__(self, server_host='192.168.1.212', tcp_port=65432, udp_port=12345, server_key_file=None):
         """
-        Initialize the Client by generating keys, connecting to the server,
-        and starting the application engine.
+        Initialize the Client by connecting to the server and starting the application engine.
+        server_key_file keeps the server's public key from the first connection, a server presenting
+        another key is refused. By default there is one file per server.
         """
         self.server_host = server_host
         self.tcp_port = tcp_port
         self.udp_port = udp_port
+        self.server_key_file = server_key_file or f"server_{server_host}_{tcp_port}.pem"
         self.running = False
-        # Generate RSA keys
-        self.private_key, self.public_key = self.make_keys()
-        self.public_key_pem = self.public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
+        self.username = None
 
-        # Create TCP socket
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            self.client_socket.connect((server_host, tcp_port))
-            print(f"Connected to server at {server_host}:{tcp_port}")
+        # Player snapshots received over UDP, the server sends deltas from the newest one we acknowledged
+        self.snapshot_history = Snapshot.SnapshotHistory()
+        self.snapshot_sequence = 0
 
-            self.client_socket.send(self.public_key_pem)
-            public_server_key_pem = self.client_socket.recv(1024)
-            self.public_server_key = load_pem_public_key(public_server_key_pem)
+        # Session of the last connection, lets a reconnect skip the key exchange
+        self.session_key = None
+        self.session_ticket = None
+        self.dictionary = None  # zstd dictionary the server sent, kept for the next connections
 
-            self.username = None
-        except Exception as e:
-            print(f"Failed to connect to server: {e}")
-            self.client_socket.close()
-            raise
+        self.connect()
 
         # Create UDP socket
         try:
@@ -54,14 +46,77 @@ class Client:
         # Initialize the application engine
         self.app_engine = Engine.AppEngine(self)
 
-    def make_keys(self):
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        public_key = private_key.public_key()
-        return private_key, public_key
+    def connect(self):
+        """
+        Open the TCP connection and set up the encrypted session, resuming the previous one if possible.
+        """
+        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.client_socket.connect((self.server_host, self.tcp_port))
+            print(f"Connected to server at {self.server_host}:{self.tcp_port}")
+            self.connection = Protocol.FramedSocket(self.client_socket)
+            self.next_request_id = 1
+            self.responses = {}  # Responses that arrived while waiting for another request
+            self.events = []  # (event, payload) pushed by the server, taken by poll_events
+
+            if self.session_ticket and self.resume_session():
+                print("Session resumed")
+            else:
+                # Ask for the server's public key, the session key is sent encrypted with it
+                self.connection.send_bytes(b'')
+                public_server_key_pem = self.connection.recv_bytes()
+                self.public_server_key = Keys.load_pinned_public_key(self.server_key_file, public_server_key_pem)
+
+                # Agree on a symmetric session key, only this key goes through RSA
+                session_key = Protocol.make_session_key()
+                self.connection.send_bytes(self.encrypt(session_key))
+                self.connection.start_session(session_key)
+                self.session_key = session_key
+                self.session_ticket = self.connection.recv_bytes()
+
+            self.negotiate_compression()
+        except Exception as e:
+            print(f"Failed to connect to server: {e}")
+            self.client_socket.close()
+            raise
 
-    def encrypt(self, text):
+    def resume_session(self):
+        """
+        Present the ticket of the previous session, returns False if the server no longer knows it.
+        The connection is encrypted with a key derived from the session key and a nonce of each side.
+        """
+        client_nonce = Protocol.make_resume_nonce()
+        self.connection.send_message(Protocol.RESUME, self.session_ticket + client_nonce)
+        _, body = self.connection.recv_message()
+        if body[:1] != b'1' or len(body) != 1 + Protocol.RESUME_NONCE_SIZE:
+            return False
+        self.connection.start_session(Protocol.resumed_session_key(self.session_key, client_nonce, bytes(body[1:])))
+        return True
+
+    def negotiate_compression(self):
+        """
+        Agree with the server on how to compress the payloads of this connection.
+        The zstd dictionary is kept, after a reconnect the server only sends it if it changed.
+        """
+        response = self.request('compression', {"codecs": Compression.available_codecs(),
+                                                "dictionary_id": Compression.dictionary_id(self.dictionary)})
+        if response['dictionary']:
+            self.dictionary = base64.b64decode(response['dictionary'])
+        elif response['dictionary_id'] is None:
+            self.dictionary = None
+        self.connection.codec = Compression.make_codec(response['codec'], self.dictionary)
+        print(f"Compression: {response['codec']}")
+
+    def reconnect(self):
+        """
+        Replace a lost TCP connection, the session is resumed so no RSA operation is needed.
+        """
+        self.client_socket.close()
+        self.connect()
+
+    def encrypt(self, data):
         return self.public_server_key.encrypt(
-            text.encode(),
+            data,
             padding.OAEP(
                 mgf=padding.MGF1(algorithm=hashes.SHA256()),
                 algorithm=hashes.SHA256(),
@@ -69,18 +124,78 @@ class Client:
             )
         )
 
+    def send_request(self, action, payload=None):
+        """
+        Send an action together with its payload without waiting for the answer.
+        Returns the request id to pass to get_response.
+        """
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        self.connection.send_request(request_id, action, payload)
+        return request_id
+
+    def get_response(self, request_id):
+        """
+        Wait for the response of a request, responses of other requests are kept until asked for.
+        """
+        while request_id not in self.responses:
+            self.receive_message()
+        return self.responses.pop(request_id)
+
+    def receive_message(self):
+        """
+        Receive one message from the server and keep it, a response by its request id or a pushed event.
+        """
+        msg_type, body = self.connection.recv_message()
+        if msg_type == Protocol.EVENT:
+            self.events.append(Protocol.unpack_event(body, self.connection.codec))
+        elif msg_type == Protocol.RESPONSE:
+            response_id, payload = Protocol.unpack_response(body, self.connection.codec)
+            self.responses[response_id] = payload
+        else:
+            raise Protocol.ProtocolError(f"Unexpected message type {msg_type}")
+
+    def subscribe(self):
+        """
+        Ask the server to push the story events to this connection.
+        """
+        return self.request('subscribe')
+
+    def poll_events(self):
+        """
+        Return the events the server pushed since the last call without waiting for any.
+        """
+        try:
+            while select.select([self.client_socket], [], [], 0)[0]:
+                self.receive_message()
+        except (socket.error, ConnectionResetError) as e:
+            print(f"Server connection lost: {e}")
+            self.cleanup_and_disconnect()
+        events, self.events = self.events, []
+        return events
+
+    def request(self, action, payload=None):
+        return self.get_response(self.send_request(action, payload))
+
+    def request_many(self, requests):
+        """
+        Pipeline a list of (action, payload) requests on the connection, returns the responses in order.
+        """
+        request_ids = [self.send_request(action, payload) for action, payload in requests]
+        return [self.get_response(request_id) for request_id in request_ids]
+
     def log_in(self, login_username, login_password):
         try:
-            self.client_socket.send(b'login')
-            response = self.client_socket.recv(1024).decode('utf-8')
             credentials = f"{login_username},{login_password}"
-            self.client_socket.send(self.encrypt(credentials))
-            response = self.client_socket.recv(1024).decode('utf-8')
+            response = self.request('login', credentials)
             if response == 'True':
                 print("Login successful!")
                 self.username = login_username
                 self.running = True
                 return True
+            elif isinstance(response, dict):
+                print(f"Login failed: {response.get('error')}")
+                return False
             else:
                 print("Login failed!")
                 return False
@@ -93,11 +208,8 @@ class Client:
 
     def register(self, user_name, username, password):
         try:
-            self.client_socket.send(b'register')
-            response = self.client_socket.recv(1024).decode('utf-8')
             user_data = f"{user_name},{username},{password}"
-            self.client_socket.send(self.encrypt(user_data))
-            response = self.client_socket.recv(1024).decode('utf-8')
+            response = self.request('register', user_data)
             print(response)
         except Exception as e:
             print(f"Error during registration: {e}")
@@ -105,93 +217,112 @@ class Client:
             print(f"Server connection lost: {e}")
             self.cleanup_and_disconnect()
 
-    def receive_stories(self):
+    def receive_stories(self, region=None, since=0):
+        """
+        Receive the stories added after version since, and with region = (min_x, min_y, max_x, max_y)
+        only the ones inside it. They are fetched page by page until the server says there are no more.
+        Returns a dict of lists (ids, titles, contents, usernames, pos_x, pos_y), the ids of the stories
+        deleted since that version ("deleted") and the version to ask from next time ("version").
+        """
         try:
-            # Send request to receive stories
-            self.client_socket.send(b'receive_stories')
-            response = self.client_socket.recv(1024).decode('utf-8')
-
-            # Receive data from server
-
-
-            data = self.client_socket.recv(4096)
-
-
-            # Decode and parse JSON
-            json_data = data.decode('utf-8')
-            stories_data = json.loads(json_data)
-
-            # Extract data into arrays
-            titles = stories_data.get('titles', [])
-            contents = stories_data.get('contents', [])
-            usernames = stories_data.get('usernames', [])
-            pos_x = stories_data.get('pos_x', [])
-            pos_y = stories_data.get('pos_y', [])
+            stories_data = {'ids': [], 'titles': [], 'contents': [], 'usernames': [], 'pos_x': [], 'pos_y': [],
+                            'deleted': [], 'version': since}
+            # The stories come in the columnar encoding, every story in one response if we want them all
+            if region is None and not since:
+                payload = {'encoding': 'columns'}
+            else:
+                payload = {'encoding': 'columns', 'since': since, 'after_id': 0}
+            if region is not None:
+                payload['region'] = list(region)
+            while True:
+                page = StoryColumns.unpack_response(self.request('receive_stories', payload))
+                if not payload.get('after_id'):
+                    # Later pages may hold stories newer than this version, they are just sent again next time
+                    stories_data['deleted'] = page.get('deleted', [])
+                    stories_data['version'] = page.get('version', since)
+                for key in ('ids', 'titles', 'contents', 'usernames', 'pos_x', 'pos_y'):
+                    stories_data[key].extend(page.get(key, []))
+                if page['next_after_id'] is None:
+                    break
+                payload['after_id'] = page['next_after_id']
 
             # Print received data
-            print("Received titles:", titles)
-            print("Received contents:", contents)
-            print("Received usernames:", usernames)
-            print("Received pos_x:", pos_x)
-            print("Received pos_y:", pos_y)
-
-            # Return extracted data
-            return titles, contents, usernames, pos_x, pos_y
+            print(f"Received {len(stories_data['ids'])} stories and {len(stories_data['deleted'])} deletions, "
+                  f"version {stories_data['version']}")
+
+            return stories_data
         except (socket.error, ConnectionResetError) as e:
             print(f"Server connection lost: {e}")
             self.cleanup_and_disconnect()
 
     def send_player_data(self, pos_x, pos_y):
-
-        # Send a message indicating that player data will be sent
+        """
+        Send our position to the server and read the snapshots it broadcast since the last call.
+        Returns (number of players, users) of the newest snapshot, or None if none arrived.
+        """
         try:
             # Prepare the data to send (username, pos_x, pos_y)
             player_data = {
                 "action": "send_player_data",
                 "username": self.username,
                 "pos_x": pos_x,
-                "pos_y": pos_y
+                "pos_y": pos_y,
+                "ack": self.snapshot_sequence
             }
 
-            # Convert the data to JSON and send it to the server
+            # Convert the data to JSON and send it to the server, the server doesn't reply to it
             data_to_send = json.dumps(player_data)
             self.udp_socket.sendto(data_to_send.encode('utf-8'), (self.server_host, self.udp_port))
             print(f"Sent player data to server: {player_data}\n")
 
-            # Wait for the server's response (list of all players)
-            data, _ = self.udp_socket.recvfrom(1024)
-
-            # Decode and parse the server's response safely
-
-            response = json.loads(data.decode('utf-8'))
-            # Assuming the response contains the number of players and the list of users
-            num_players = response.get('num_players', 0)  # Default to 0 if 'num_players' is not in the response
-            print(f"Received server response: {response}")
-
-            # Extract players' information safely
-            users_db = response.get('players', [])
-            users = []
-            for user in users_db:
-                username = user.get('username', 'Unknown')  # Default to 'Unknown' if username is not found
-                pos_x = user.get('pos_x', 0)  # Default to 0 if pos_x is not found
-                pos_y = user.get('pos_y', 0)  # Default to 0 if pos_y is not found
-                print(f"Username: {username}, Position: ({pos_x}, {pos_y})")
-                users.append(User(username, pos_x, pos_y))
-
-            return num_players, users
+            # Apply the snapshots waiting in the socket
+            players = None
+            self.udp_socket.setblocking(False)
+            try:
+                while True:
+                    data, _ = self.udp_socket.recvfrom(65535)
+                    applied = self.apply_snapshot(data)
+                    if applied is not None:
+                        players = applied
+            except BlockingIOError:
+                pass
+            finally:
+                self.udp_socket.setblocking(True)
+
+            if players is None:
+                return None
+
+            users = [User(username, pos_x, pos_y) for username, (pos_x, pos_y) in players.items()]
+            return len(users), users
         except (socket.error, ConnectionResetError) as e:
             print(f"Server connection lost: {e}")
             self.cleanup_and_disconnect()
 
+    def apply_snapshot(self, data):
+        """
+        Rebuild the players of a snapshot packet from its baseline.
+        Returns the players (username -> (pos_x, pos_y)), or None if the packet is old or its baseline unknown.
+        """
+        if not Snapshot.is_snapshot(data):
+            return None
+        sequence, baseline_sequence, changed, removed = Snapshot.unpack_delta(data)
+        if sequence <= self.snapshot_sequence:
+            return None  # Arrived out of order
+
+        baseline = {} if baseline_sequence == 0 else self.snapshot_history.get(baseline_sequence)
+        if baseline is None:
+            return None
+
+        players = Snapshot.apply_delta(baseline, changed, removed)
+        self.snapshot_history.add(sequence, players)
+        self.snapshot_sequence = sequence
+        return players
+
     def logout(self):
         try:
             # Send logout request over TCP to the server
-            self.client_socket.send(b'logout')
-            response = self.client_socket.recv(1024).decode('utf-8')
-
-            # Send the username over TCP for the server to process
-            self.client_socket.send(self.username.encode('utf-8'))
-            response = self.client_socket.recv(1024).decode('utf-8')
+            # Send the logout request with the username over TCP for the server to process
+            response = self.request('logout', self.username)
             print(response)
 
             # Notify the server via UDP that the client is logging out
@@ -202,7 +333,12 @@ class Client:
             data_to_send = json.dumps(logout_message)
             self.udp_socket.sendto(data_to_send.encode('utf-8'), (self.server_host, self.udp_port))
             print(f"Sent logout message to server via UDP: {logout_message}")
-            response, _ = self.udp_socket.recvfrom(1024)
+
+            # Skip the snapshots that were still on their way
+            self.udp_socket.settimeout(1.0)
+            response, _ = self.udp_socket.recvfrom(65535)
+            while Snapshot.is_snapshot(response):
+                response, _ = self.udp_socket.recvfrom(65535)
             print(response)
         except Exception as e:
             print(f"Error during logout: {e}")
@@ -218,26 +354,47 @@ class Client:
         return self.username
 
     def add_story(self, title, content, username, pos_x, pos_y):
+        """
+        Send the whole story in one request, returns the id the server gave it.
+        """
         try:
-            self.client_socket.send(b'add_story')
-            response = self.client_socket.recv(1024).decode('utf-8')
-            self.client_socket.send(title.encode())
-            self.client_socket.recv(1024)
-            self.client_socket.send(content.encode())
-            self.client_socket.recv(1024)
-            self.client_socket.send(username.encode())
-            self.client_socket.recv(1024)
-            self.client_socket.send(str(pos_x).encode())
-            self.client_socket.recv(1024)
-            self.client_socket.send(str(pos_y).encode())
-            response = self.client_socket.recv(1024).decode('utf-8')
-            print(response)
+            story = {"title": title, "content": content, "username": username, "pos_x": pos_x, "pos_y": pos_y}
+            story_id = self.request('add_story', story)["story_id"]
+            print(f"Story added with id {story_id}")
+            return story_id
         except Exception as e:
             print(f"Error adding story: {e}")
         except (socket.error, ConnectionResetError) as e:
             print(f"Server connection lost: {e}")
             self.cleanup_and_disconnect()
 
+    def delete_story(self, story_id):
+        """
+        Delete one of our stories, returns True if the server deleted it.
+        """
+        try:
+            deleted = self.request('delete_story', {"story_id": story_id})["deleted"]
+            print(f"Story {story_id} deleted: {deleted}")
+            return deleted
+        except (socket.error, ConnectionResetError) as e:
+            print(f"Server connection lost: {e}")
+            self.cleanup_and_disconnect()
+
+    def add_stories(self, stories):
+        """
+        Send many stories (dicts with title, content, username, pos_x and pos_y) in one request,
+        returns their ids in the same order.
+        """
+        try:
+            story_ids = self.request('add_stories', {"stories": stories})["story_ids"]
+            print(f"Added {len(story_ids)} stories")
+            return story_ids
+        except Exception as e:
+            print(f"Error adding stories: {e}")
+        except (socket.error, ConnectionResetError) as e:
+            print(f"Server connection lost: {e}")
+            self.cleanup_and_disconnect()
+
     def cleanup_and_disconnect(self):
         try:
             self.running = False
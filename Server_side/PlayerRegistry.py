@@ -0,0 +1,107 @@
+import threading
+import time
+from Shared import SpatialGrid, Snapshot
+
+
+class PlayerEntry:
+    """
+    State the server keeps for one connected player.
+    """
+    __slots__ = ('username', 'pos_x', 'pos_y', 'last_seen', 'address', 'acked_sequence', 'history')
+
+    def __init__(self, username, pos_x, pos_y, address=None):
+        self.username = username
+        self.pos_x = pos_x
+        self.pos_y = pos_y
+        self.last_seen = time.time()
+        self.address = address
+        self.acked_sequence = 0  # Newest snapshot the client has, 0 until it has one
+        self.history = Snapshot.SnapshotHistory()  # Snapshots sent to this client
+
+
+class PlayerRegistry:
+    """
+    Thread-safe registry of the connected players keyed by username.
+    Positions are also kept in a spatial grid so the players around a point can be found
+    without looking at every player.
+    """
+
+    def __init__(self, cell_size=512):
+        self.lock = threading.Lock()
+        self.players = {}  # username -> PlayerEntry
+        self.grid = SpatialGrid.SpatialGrid(cell_size)
+        self.snapshot_cache = None  # Rebuilt only after the players changed
+
+    def __len__(self):
+        return len(self.players)
+
+    def __contains__(self, username):
+        return username in self.players
+
+    def get(self, username):
+        return self.players.get(username)
+
+    def update(self, username, pos_x, pos_y, address=None, acked_sequence=None):
+        """
+        Update the position of a player, adding it if it is new. Returns the player's entry.
+        acked_sequence is the newest snapshot the player's client acknowledged.
+        The grid is moved first, so a position it refuses leaves the registry unchanged.
+        """
+        with self.lock:
+            self.grid.move(username, pos_x, pos_y)
+            player = self.players.get(username)
+            if player is None:
+                player = PlayerEntry(username, pos_x, pos_y, address)
+                self.players[username] = player
+            else:
+                player.pos_x = pos_x
+                player.pos_y = pos_y
+                player.last_seen = time.time()
+                if address is not None:
+                    player.address = address
+            if acked_sequence is not None:
+                player.acked_sequence = acked_sequence
+            self.snapshot_cache = None
+            return player
+
+    def remove(self, username):
+        """
+        Remove a player, returns False if it was not registered.
+        """
+        with self.lock:
+            if self.players.pop(username, None) is None:
+                return False
+            self.grid.remove(username)
+            self.snapshot_cache = None
+            return True
+
+    def remove_stale(self, max_age):
+        """
+        Remove the players not heard from in max_age seconds, returns their usernames.
+        """
+        oldest = time.time() - max_age
+        with self.lock:
+            stale = [username for username, player in self.players.items() if player.last_seen < oldest]
+            for username in stale:
+                del self.players[username]
+                self.grid.remove(username)
+            if stale:
+                self.snapshot_cache = None
+        return stale
+
+    def snapshot(self):
+        """
+        Return a list of every player's entry, safe to iterate without the lock.
+        """
+        with self.lock:
+            if self.snapshot_cache is None:
+                self.snapshot_cache = list(self.players.values())
+            return self.snapshot_cache
+
+    def in_view(self, center_x, center_y, width, height):
+        """
+        Return (username, pos_x, pos_y) of the players inside a view centred on (center_x, center_y).
+        """
+        with self.lock:
+            return [(username, *self.grid.positions[username])
+                    for username in self.grid.query_view(center_x, center_y, width, height)]
@@ -0,0 +1,52 @@
+import threading
+
+
+class ResponseCache:
+    """
+    Encoded responses kept with the version of the story store they were built from.
+    A response is served again until a write moves the store to a newer version, and
+    concurrent requests for a missing response wait for the one thread building it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_locks = {}  # key -> Lock held while the response of that key is built
+        self.entries = {}  # key -> (version, encoded response)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, version):
+        entry = self.entries.get(key)
+        # A response built after a newer write is as good as one of this version
+        if entry is not None and entry[0] >= version:
+            with self.lock:
+                self.hits += 1
+            return entry[1]
+        return None
+
+    def get(self, key, version, build):
+        """
+        Return the cached response of key if it is at least as new as version, else build() it and keep it.
+        version must be read from the store before calling, so a write during build() is never missed.
+        """
+        response = self.lookup(key, version)
+        if response is not None:
+            return response
+
+        with self.lock:
+            build_lock = self.build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            # Built by another thread while we waited
+            response = self.lookup(key, version)
+            if response is not None:
+                return response
+
+            response = build()
+            self.entries[key] = (version, response)
+            with self.lock:
+                self.misses += 1
+            return response
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
@@ -1,32 +1,141 @@
+import asyncio
+import base64
+import queue
 import socket
 import threading
-from cryptography.hazmat.primitives.serialization import load_pem_public_key
-from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import hashes
-from Server_side import SqlDataBase, jsonDataBase
-from Client_side.App.User import User
+from Server_side import SqlDataBase, SqlStoryDataBase, jsonDataBase, PlayerRegistry, ResponseCache, WorkerPool
+from Shared import Compression, Protocol, Snapshot, StoryColumns
+from Shared import Keys
 import json
+import math
+import os
 import time
 
+SESSION_LIFETIME = 60 * 60  # Seconds a session ticket can be used to resume
+
+# A client only receives the players it can see: the 1280x720 camera around it plus a margin
+VIEW_WIDTH = 1280 + 400
+VIEW_HEIGHT = 720 + 400
+
+STORY_PAGE_SIZE = 200  # Stories per page of a region query
+MAX_STORY_PAGE_SIZE = 1000
+
+PLAYER_TIMEOUT = 10  # Seconds without a position update before a player is dropped
+TICK_REPORT_INTERVAL = 10  # Seconds between two prints of the tick metrics
+
+# A subscriber that doesn't read its events is dropped past this many waiting events (threaded mode)
+# or bytes waiting in its transport (asyncio mode), and told so with an "unsubscribed" event
+MAX_PENDING_EVENTS = 256
+MAX_EVENT_BUFFER = 1024 * 1024
+
+MAX_COORDINATE = 2 ** 31 - 1  # Positions are sent to the clients as 32-bit ints
+
+AUTH_ACTIONS = ('login', 'register')  # Actions that hash a password, they run on the auth pool
+AUTH_BUSY = {"error": "Server busy, try again later"}
+
+
+def is_coordinate(value):
+    """
+    True for a finite int or float position that fits the 32-bit ints of the snapshots (bools excluded).
+    """
+    if type(value) not in (int, float):
+        return False
+    return math.isfinite(value) and -MAX_COORDINATE <= value <= MAX_COORDINATE
+
+
+def clamp_coordinate(value):
+    return max(-MAX_COORDINATE, min(MAX_COORDINATE, int(value)))
+
+
+def read_story(story):
+    """
+    The fields of a story sent by a client, its position converted to ints.
+    Raises ValueError if a field is missing or the story can't be stored.
+    """
+    try:
+        entry = {"title": story['title'], "content": story['content'], "username": story['username'],
+                 "pos_x": int(story['pos_x']), "pos_y": int(story['pos_y'])}
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise ValueError("Incomplete story or position that is not a number")
+    if not StoryColumns.is_valid_story(**entry):
+        raise ValueError("Invalid story")
+    return entry
+
 
 class Server:
-    def __init__(self, host='192.168.1.212', port=65432, udp_port=12345):
+    def __init__(self, host='192.168.1.212', port=65432, udp_port=12345, backlog=5, max_connections=None,
+                 use_asyncio=False, key_file='server_key.pem', tick_rate=20, story_store='json',
+                 auth_workers=2, max_auth_pending=32):
         """
-        Initialize the Server, generate keys, and start the server socket.
+        Initialize the Server, load its keys, and start the server socket.
+        backlog is passed to listen(), max_connections caps the number of clients served at once
+        (None means no limit) and use_asyncio serves the TCP actions as coroutines instead of threads.
+        key_file is the PEM file holding the server's private key, it is created on the first start.
+        tick_rate is how many times per second the players' positions are broadcast.
+        story_store selects where stories are kept: 'json' (data.json) or 'sql' (stories.db, migrated
+        from data.json on its first start).
+        Logins and registrations hash the password on a pool of auth_workers threads, with at most
+        max_auth_pending of them waiting or running, the ones past that are refused.
         """
-        # Initialize the databases (SQL and JSON)
+        # Initialize the databases (SQL for users, JSON or SQL for stories)
         self.sql_data_base = SqlDataBase.SqlDataBase()
-        self.json_data_base = jsonDataBase.jsonDataBase()
+        if story_store == 'sql':
+            self.story_data_base = SqlStoryDataBase.SqlStoryDataBase()
+            self.story_data_base.migrate_from_json()
+        else:
+            self.story_data_base = jsonDataBase.jsonDataBase()
+
+        # Compression codecs clients can ask for, zstd gets a dictionary trained on the newest stories
+        self.zstd_dictionary = Compression.train_dictionary(
+            self.story_data_base.sample_texts(Compression.MAX_DICTIONARY_SAMPLES))
+        self.zstd_dictionary_id = Compression.dictionary_id(self.zstd_dictionary)
+        self.codecs = {name: Compression.make_codec(name, self.zstd_dictionary)
+                       for name in Compression.available_codecs()}
 
         # Set host and ports for the server
         self.host = host
         self.port = port
         self.udp_port = udp_port
-        self.players = []
-
-        # Generate RSA keys (private and public) for encryption/decryption
+        self.players = PlayerRegistry.PlayerRegistry()  # Connected players by username, shared by all threads
+        self.tick_rate = tick_rate
+        self.tick_sequence = 0  # Sequence number of the last broadcast snapshot
+
+        # Tick duration metrics, reset after every report
+        self.tick_count = 0
+        self.tick_time_total = 0.0
+        self.tick_time_max = 0.0
+        self.late_ticks = 0
+        self.last_tick_report = time.time()
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.use_asyncio = use_asyncio
+
+        # Number of TCP clients currently being served
+        self.active_connections = 0
+        self.connections_lock = threading.Lock()
+
+        # Session keys of previous connections by ticket, so reconnecting clients can skip the key exchange
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+
+        # Password hashing is slow on purpose, it runs on its own bounded pool
+        self.auth_pool = WorkerPool.WorkerPool(auth_workers, max_auth_pending, 'auth')
+
+        # Encoded full story snapshots, rebuilt only after the stories changed
+        self.story_cache = ResponseCache.ResponseCache()
+
+        # Connections subscribed to story events -> their queue of packed events (threaded mode, None in
+        # asyncio mode), and the events waiting to be packed
+        self.subscribers = {}
+        self.subscribers_lock = threading.Lock()
+        self.event_queue = queue.Queue()
+        self.loop = None  # Event loop of the asyncio serving mode, events are sent from it
+
+        # Load the RSA keys (private and public) for encryption/decryption
+        self.key_file = key_file
         self.private_key, self.public_key = self.make_keys()
         self.public_key_pem = self.public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
@@ -39,7 +148,7 @@ class Server:
         # Set up the server socket and start listening for incoming connections
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(self.backlog)
         print(f"Server listening on {self.host}:{self.port}...")
 
         # Create UDP socket for receiving player updates
@@ -52,18 +161,124 @@ class Server:
         udp_thread.daemon = True  # Ensures the thread exits when the main program stops
         udp_thread.start()
 
+        # Start the server tick that broadcasts the players' positions
+        tick_thread = threading.Thread(target=self.run_ticks)
+        tick_thread.daemon = True
+        tick_thread.start()
+
         # Start accepting incoming connections in a loop
         print("Server is running...")
-        self.listen_for_clients()
+        if self.use_asyncio:
+            asyncio.run(self.serve_async())
+        else:
+            # Events are sent by their own thread so the client that triggered one gets its response first
+            event_thread = threading.Thread(target=self.publish_events)
+            event_thread.daemon = True
+            event_thread.start()
+            self.listen_for_clients()
 
     def make_keys(self):
         """
-        Generate a new RSA key pair (private and public).
+        Load the server's RSA key pair (private and public), generating it only if the key file is missing.
         """
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_key = Keys.load_or_create_private_key(self.key_file)
         public_key = private_key.public_key()
         return private_key, public_key
 
+    def new_session_ticket(self, session_key):
+        """
+        Remember a session key and return the ticket that resumes it.
+        """
+        ticket = os.urandom(Protocol.TICKET_SIZE)
+        now = time.time()
+        with self.sessions_lock:
+            # Drop expired sessions while we are here
+            for old_ticket in [t for t, (_, expires, _) in self.sessions.items() if expires < now]:
+                del self.sessions[old_ticket]
+            self.sessions[ticket] = (session_key, now + SESSION_LIFETIME, None)
+        return ticket
+
+    def resume_session(self, ticket):
+        """
+        Return (session key, logged in username or None) of a ticket, or None if it is unknown or expired.
+        """
+        with self.sessions_lock:
+            session = self.sessions.get(ticket)
+        if session and session[1] >= time.time():
+            return session[0], session[2]
+        return None
+
+    def set_user(self, connection, username):
+        """
+        Remember who logged in on a connection, and on its session so a resumed connection is still logged in.
+        None logs the connection and its session out.
+        """
+        connection.username = username
+        with self.sessions_lock:
+            session = self.sessions.get(connection.session_ticket)
+            if session:
+                self.sessions[connection.session_ticket] = (session[0], session[1], username)
+
+    def resume(self, body, connection):
+        """
+        Answer a RESUME message (ticket + client nonce), returns (reply, key of this connection or None).
+        """
+        ticket, client_nonce = bytes(body[:Protocol.TICKET_SIZE]), bytes(body[Protocol.TICKET_SIZE:])
+        session = self.resume_session(ticket)
+        if session is None or len(client_nonce) != Protocol.RESUME_NONCE_SIZE:
+            return b'0', None
+        session_key, connection.username = session
+        connection.session_ticket = ticket
+        server_nonce = Protocol.make_resume_nonce()
+        return b'1' + server_nonce, Protocol.resumed_session_key(session_key, client_nonce, server_nonce)
+
+    def handshake(self, connection):
+        """
+        Set up the encrypted session of a new connection.
+        A client holding a valid session ticket resumes its session with a key derived for this connection,
+        otherwise it asks for our public key and sends a new session key encrypted with it.
+        """
+        msg_type, body = connection.recv_message()
+        if msg_type == Protocol.RESUME:
+            reply, connection_key = self.resume(body, connection)
+            connection.send_message(Protocol.RESUME, reply)
+            if connection_key:
+                connection.start_session(connection_key, server=True)
+                return
+            msg_type, body = connection.recv_message()
+        if msg_type != Protocol.BYTES:
+            raise Protocol.ProtocolError(f"Expected a key request, got message type {msg_type}")
+
+        connection.send_bytes(self.public_key_pem)
+
+        session_key = self.decrypt(connection.recv_bytes())
+        connection.start_session(session_key, server=True)
+        connection.session_ticket = self.new_session_ticket(session_key)
+        connection.send_bytes(connection.session_ticket)
+
+    async def handshake_async(self, connection):
+        """
+        Coroutine version of handshake.
+        """
+        msg_type, body = await connection.recv_message()
+        if msg_type == Protocol.RESUME:
+            reply, connection_key = self.resume(body, connection)
+            await connection.send_message(Protocol.RESUME, reply)
+            if connection_key:
+                connection.start_session(connection_key, server=True)
+                return
+            msg_type, body = await connection.recv_message()
+        if msg_type != Protocol.BYTES:
+            raise Protocol.ProtocolError(f"Expected a key request, got message type {msg_type}")
+
+        await connection.send_bytes(self.public_key_pem)
+
+        # RSA decryption takes about half a millisecond, done on the loop it would stall every connection
+        session_key = await self.loop.run_in_executor(None, self.decrypt, await connection.recv_bytes())
+        connection.start_session(session_key, server=True)
+        connection.session_ticket = self.new_session_ticket(session_key)
+        await connection.send_bytes(connection.session_ticket)
+
     def decrypt(self, encrypted_text):
         """
         Decrypt the encrypted message using the private key.
@@ -83,10 +298,42 @@ class Server:
         """
         while True:
             client_socket, client_address = self.server_socket.accept()
+            if not self.acquire_connection():
+                print(f"Connection limit reached, refusing {client_address}\n")
+                client_socket.close()
+                continue
             print(f"Connection established with {client_address}\n")
             client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_address))
             client_thread.start()
 
+    def acquire_connection(self):
+        """
+        Reserve a slot for a new client, returns False if max_connections clients are already served.
+        """
+        with self.connections_lock:
+            if self.max_connections is not None and self.active_connections >= self.max_connections:
+                return False
+            self.active_connections += 1
+            return True
+
+    def release_connection(self):
+        """
+        Free the slot of a client that disconnected.
+        """
+        with self.connections_lock:
+            self.active_connections -= 1
+
+    async def serve_async(self):
+        """
+        Serve the TCP actions with asyncio on the already listening server socket.
+        """
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_client_async, sock=self.server_socket,
+                                            backlog=self.backlog)
+        print(f"Asyncio server serving on {self.host}:{self.port}...")
+        async with server:
+            await server.serve_forever()
+
     def listen_for_udp(self):
         """
         Listen for incoming UDP messages and handle them.
@@ -98,24 +345,29 @@ class Server:
                 print("Socket is closed.")
                 break
             # Receive data from the socket
-            massage, client_address = self.udp_socket.recvfrom(1024)
-            data = json.loads(massage.decode('utf-8'))
-            action = data['action']
-
-
-            print(f"Received UDP message from {client_address}: {action}\n")
-
-            if action == "send_player_data":
-                self.update_and_send_players(data, client_address)
-            elif action == "logout":
-                self.handle_logout_udp(data, client_address)
-
-
-
-
-    def update_and_send_players(self, data, client_address):
+            try:
+                massage, client_address = self.udp_socket.recvfrom(1024)
+            except OSError as e:
+                print(f"Error receiving UDP message: {e}")
+                continue
+
+            # A bad datagram only loses itself, the listener keeps serving the other players
+            try:
+                data = json.loads(massage.decode('utf-8'))
+                action = data['action']
+
+                print(f"Received UDP message from {client_address}: {action}\n")
+
+                if action == "send_player_data":
+                    self.update_player_data(data, client_address)
+                elif action == "logout":
+                    self.handle_logout_udp(data, client_address)
+            except Exception as e:
+                print(f"Error handling UDP message from {client_address}: {e}")
+
+    def update_player_data(self, data, client_address):
         """
-        Receive player data from a client (username, pos_x, pos_y) and send all players' information via UDP.
+        Receive player data from a client (username, pos_x, pos_y), it is sent to the other clients on the next tick.
         """
         if not data:  # Check if the data is empty
             print("Received empty data, ignoring...")
@@ -128,173 +380,518 @@ class Server:
         pos_y = data.get("pos_y")
 
         print(f"Received via UDP -> username: {username}, x: {pos_x}, y: {pos_y}\n")
+        if username is None or pos_x is None or pos_y is None:
+            print("Received incomplete player data, ignoring...")
+            return
+        if not isinstance(username, str) or not is_coordinate(pos_x) or not is_coordinate(pos_y):
+            print("Received invalid player data, ignoring...")
+            return
+        if len(username.encode('utf-8')) > Snapshot.MAX_USERNAME_SIZE:
+            print("Received a username too long for the snapshots, ignoring...")
+            return
+        acked_sequence = data.get("ack")
+        if acked_sequence is not None and (type(acked_sequence) is not int or acked_sequence < 0):
+            acked_sequence = None
+
+        self.update_player(username, pos_x, pos_y, client_address, acked_sequence)
+
+    def run_ticks(self):
+        """
+        Server tick: every 1 / tick_rate seconds broadcast the positions gathered since the last tick.
+        """
+        interval = 1 / self.tick_rate
+        next_tick = time.perf_counter()
+        while True:
+            start = time.perf_counter()
+            try:
+                self.broadcast_players()
+            except Exception as e:
+                print(f"Error during tick: {e}")
+            self.record_tick(time.perf_counter() - start, interval)
+
+            next_tick += interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter()  # The tick ran late, don't try to catch up
 
-        # Update or add the player to the list
-        player_updated = False
-        for player in self.players:
-            if player.username == username:
-                player.pos_x = pos_x
-                player.pos_y = pos_y
-                player_updated = True
-                print(f"Updated existing player: {username} with new position.")
-                break
-
-        if not player_updated:
-            self.players.append(User(username, pos_x, pos_y))
-            print(f"Added new player: {username}")
-
-        # Prepare and send all players' information to the client
-        players_data = {
-            "num_players": len(self.players),
-            "players": [{"username": player.username, "pos_x": player.pos_x, "pos_y": player.pos_y} for player in
-                        self.players]
-        }
-        # Convert the players data to a JSON string and send it via UDP
-        data_to_send = json.dumps(players_data)
-        self.udp_socket.sendto(data_to_send.encode('utf-8'), client_address)
-        print("All players' data sent successfully via UDP.\n")
+    def broadcast_players(self):
+        """
+        Send every known client one snapshot of the players in its view, as a delta from the
+        newest snapshot the client acknowledged (or a full snapshot if we no longer have it).
+        A crowded view is cut down to the nearest players that fit in one datagram.
+        """
+        for username in self.players.remove_stale(PLAYER_TIMEOUT):
+            print(f"Player {username} timed out.")
+
+        self.tick_sequence += 1
+        for player in self.players.snapshot():
+            if player.address is None:
+                continue
+            # One player's failure must not cost the others their snapshot
+            try:
+                players = {username: (int(x), int(y)) for username, x, y in
+                           self.players.in_view(player.pos_x, player.pos_y, VIEW_WIDTH, VIEW_HEIGHT)}
+
+                baseline_sequence = player.acked_sequence
+                baseline = player.history.get(baseline_sequence)
+                if baseline is None:
+                    baseline_sequence, baseline = 0, {}
+
+                packet, players = Snapshot.pack_view(self.tick_sequence, baseline_sequence, baseline, players,
+                                                     player.pos_x, player.pos_y)
+                player.history.add(self.tick_sequence, players)
+                self.udp_socket.sendto(packet, player.address)
+            except Exception as e:
+                print(f"Error sending the snapshot of {player.username}: {e}")
+
+    def record_tick(self, duration, interval):
+        """
+        Add a tick to the metrics and print them every TICK_REPORT_INTERVAL seconds.
+        """
+        self.tick_count += 1
+        self.tick_time_total += duration
+        self.tick_time_max = max(self.tick_time_max, duration)
+        if duration > interval:
+            self.late_ticks += 1
+
+        now = time.time()
+        if now - self.last_tick_report >= TICK_REPORT_INTERVAL:
+            story_cache = self.story_cache.stats()
+            print(f"Ticks: {self.tick_count} at {self.tick_rate} Hz, "
+                  f"avg {self.tick_time_total / self.tick_count * 1000:.2f} ms, "
+                  f"max {self.tick_time_max * 1000:.2f} ms, {self.late_ticks} over budget, "
+                  f"{len(self.players)} players, "
+                  f"story cache {story_cache['hits']} hits / {story_cache['misses']} misses "
+                  f"({story_cache['entries']} responses), "
+                  f"{self.auth_pool.rejected} logins refused\n")
+            self.tick_count = 0
+            self.tick_time_total = 0.0
+            self.tick_time_max = 0.0
+            self.late_ticks = 0
+            self.last_tick_report = now
+
+    def update_player(self, username, pos_x, pos_y, client_address=None, acked_sequence=None):
+        """
+        Update or add a player in the players registry.
+        """
+        self.players.update(username, pos_x, pos_y, client_address, acked_sequence)
 
-    def handle_receive_stories(self, client_socket):
+    def handle_receive_stories(self, payload):
         """
         Handle the request for stories from the client using TCP.
+        Without a payload every story is sent. A payload with "region": [min_x, min_y, max_x, max_y]
+        or "center": [x, y] and "radius" only asks for the stories in that area, one page at a time:
+        "limit" stories with an id greater than "after_id". With "since" only the stories added after
+        that version are sent, along with the ids of the stories deleted after it.
+        With "encoding": "columns" the response is the same data in the columnar binary encoding
+        (StoryColumns), and a payload with nothing else gets every story at once, unpaged.
         """
-        print("Sending stories to client via TCP...\n")
+        if not payload:
+            print("Sending stories to client via TCP...\n")
+            return self.story_cache.get("json", self.story_data_base.version, self.encode_all_stories)
+
+        columns = payload.get("encoding") == "columns"
+        if columns and payload.keys() == {"encoding"}:
+            version = self.story_data_base.version
+            return self.story_cache.get("columns", version, lambda: Protocol.EncodedPayload(
+                StoryColumns.pack_response(self.story_data_base.snapshot_columns(), [], version, None)))
+
+        limit = max(1, min(int(payload.get("limit", STORY_PAGE_SIZE)), MAX_STORY_PAGE_SIZE))
+        after_id = int(payload.get("after_id", 0))
+        since = int(payload.get("since", 0))
+        # Read before the query, a story added meanwhile is sent again next time rather than missed
+        version = self.story_data_base.version
+
+        if "center" in payload:
+            center_x, center_y = payload["center"]
+            radius = payload["radius"]
+            region = (center_x - radius, center_y - radius, center_x + radius, center_y + radius)
+        else:
+            region = payload.get("region")
+        if region is not None:
+            # No story is placed outside the 32-bit range, a bigger region only costs more to search
+            region = [clamp_coordinate(value) for value in region]
 
+        if region is None:
+            page = self.story_data_base.query_since(since, limit=limit, after_id=after_id)
+        else:
+            page = self.story_data_base.query_region(*region, limit=limit, after_id=after_id, since=since)
+        stories = page
+        if "center" in payload:
+            stories = [story for story in page
+                       if (story['pos_x'] - center_x) ** 2 + (story['pos_y'] - center_y) ** 2 <= radius ** 2]
+        print(f"Sending {len(stories)} stories in {region} since version {since} to client via TCP...\n")
+
+        # Stories deleted since the client's version are sent with the first page only
+        deleted = self.story_data_base.tombstones_since(since) if since and not after_id else []
+        # A full page means there may be more, the client asks again with this as after_id
+        next_after_id = page[-1]['id'] if len(page) == limit else None
+        if columns:
+            return StoryColumns.pack_response(StoryColumns.pack_entries(stories), deleted, version, next_after_id)
+        response = self.stories_changed(stories, deleted, version)
+        response["next_after_id"] = next_after_id
+        return response
+
+    def encode_all_stories(self):
+        """
+        The JSON response with every story, encoded once per version of the store by the story cache.
+        """
         # Retrieve data from database
-        titles, contents, usernames, pos_x, pos_y = self.json_data_base.receive_data()
+        titles, contents, usernames, pos_x, pos_y = self.story_data_base.receive_data()
 
-        # Create dictionary with the data
-        data = {
+        # Create dictionary with the data, it is sent back as one JSON response
+        return Protocol.EncodedPayload({
             "titles": titles or [],
             "contents": contents or [],
             "usernames": usernames or [],
             "pos_x": pos_x or [],
             "pos_y": pos_y or []
+        })
+
+    @staticmethod
+    def stories_changed(stories, deleted, version):
+        """
+        The stories (dicts with id, title, content, username, pos_x and pos_y) as lists, the ids of the
+        deleted stories and the version of the store, the shape of both receive_stories responses and
+        stories_changed events.
+        """
+        return {
+            "ids": [story['id'] for story in stories],
+            "titles": [story['title'] for story in stories],
+            "contents": [story['content'] for story in stories],
+            "usernames": [story['username'] for story in stories],
+            "pos_x": [story['pos_x'] for story in stories],
+            "pos_y": [story['pos_y'] for story in stories],
+            "deleted": deleted,
+            "version": version
         }
 
-        # Convert to JSON string
-        json_data = json.dumps(data)
+    def handle_compression(self, payload):
+        """
+        Pick the first codec of the client's list ("codecs") that the server supports, None for no compression.
+        The zstd dictionary is sent along unless the client has it already ("dictionary_id"),
+        the connection starts compressing once this response is sent.
+        """
+        codec = next((name for name in payload['codecs'] if name in self.codecs), None)
+        dictionary_id = self.zstd_dictionary_id if codec == 'zstd' else None
+        send_dictionary = dictionary_id is not None and payload.get('dictionary_id') != dictionary_id
+        return {"codec": codec, "dictionary_id": dictionary_id,
+                "dictionary": base64.b64encode(self.zstd_dictionary).decode('ascii') if send_dictionary else None}
 
-        try:
-            # Send data through TCP socket
-            client_socket.send(json_data.encode('utf-8'))
-            print("Stories sent successfully.\n")
-        except Exception as e:
-            print(f"Error sending stories: {e}")
+    def handle_subscribe(self, connection):
+        """
+        Send the story events to this connection from now on.
+        In threaded mode each subscriber has its own bounded queue and sender thread, so a client
+        that doesn't read its socket only blocks its own events.
+        """
+        with self.subscribers_lock:
+            if connection in self.subscribers:
+                return "Subscribed."
+            events = None if self.use_asyncio else queue.Queue(MAX_PENDING_EVENTS)
+            self.subscribers[connection] = events
+        if events is not None:
+            sender_thread = threading.Thread(target=self.send_events, args=(connection, events))
+            sender_thread.daemon = True
+            sender_thread.start()
+        return "Subscribed."
+
+    def unsubscribe(self, connection, last_event=None):
+        """
+        Stop sending events to a connection, last_event (a packed event body) is still sent to it.
+        """
+        with self.subscribers_lock:
+            events = self.subscribers.pop(connection, None)
+        if events is None:
+            return
+        # The events still waiting are dropped, then the sender thread is told to stop
+        while True:
+            try:
+                events.get_nowait()
+            except queue.Empty:
+                break
+        if last_event is not None:
+            events.put_nowait(last_event)
+        events.put_nowait(None)
 
+    def send_events(self, connection, events):
+        """
+        Sender thread of a subscriber (threaded serving mode), stops at None.
+        """
+        while True:
+            body = events.get()
+            if body is None:
+                return
+            try:
+                connection.send_message(Protocol.EVENT, body)
+            except Exception as e:
+                print(f"Error sending event: {e}\n")
+                self.unsubscribe(connection)
+                return
+
+    @staticmethod
+    def unsubscribed_event(connection):
+        return Protocol.pack_event('unsubscribed', {"reason": "Too many events waiting"}, connection.codec)
+
+    def publish_event(self, event, payload):
+        """
+        Push an event to every subscribed connection. Its payload is encoded once here and compressed
+        once per codec, only the encryption is done per connection.
+        """
+        payload = Protocol.EncodedPayload(payload)
+        if self.use_asyncio:
+            self.loop.call_soon_threadsafe(self.fan_out_async, event, payload)
+        else:
+            self.event_queue.put((event, payload))
 
+    def publish_events(self):
+        """
+        Hand the queued events to the sender threads of the subscribers (threaded serving mode).
+        A subscriber whose queue is full is dropped instead of waited for.
+        """
+        while True:
+            event, payload = self.event_queue.get()
+            with self.subscribers_lock:
+                subscribers = list(self.subscribers.items())
+            for connection, events in subscribers:
+                try:
+                    events.put_nowait(Protocol.pack_event(event, payload, connection.codec))
+                except queue.Full:
+                    print("A subscriber is not reading its events, unsubscribing it.\n")
+                    self.unsubscribe(connection, self.unsubscribed_event(connection))
+
+    def fan_out_async(self, event, payload):
+        """
+        Queue an event on every subscribed stream (asyncio serving mode), the transports flush them.
+        A stream whose peer left more than MAX_EVENT_BUFFER bytes unread is dropped.
+        """
+        # Subscriptions are added from the executor threads
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+        for connection in subscribers:
+            try:
+                if connection.pending_bytes() > MAX_EVENT_BUFFER:
+                    print("A subscriber is not reading its events, unsubscribing it.\n")
+                    self.unsubscribe(connection)
+                    connection.write_message(Protocol.EVENT, self.unsubscribed_event(connection))
+                    continue
+                connection.write_message(Protocol.EVENT, Protocol.pack_event(event, payload, connection.codec))
+            except Exception as e:
+                print(f"Error sending event: {e}\n")
+                self.unsubscribe(connection)
+
+    def handle_action(self, action, payload, connection=None):
+        """
+        Run the handler of an action and return the payload of its response.
+        connection is the client's connection, needed by the actions that push to it later.
+        """
+        print(f"Action received: {action}\n")
+
+        if action == 'login':
+            return self.handle_login(payload)
+
+        elif action == 'receive_stories':
+            return self.handle_receive_stories(payload)
+
+        elif action == 'register':
+            return self.handle_register(payload)
+
+        elif action == 'add_story':
+            return self.handle_add_story(payload)
+
+        elif action == 'add_stories':
+            return self.handle_add_stories(payload)
+
+        elif action == 'delete_story':
+            return self.handle_delete_story(payload, connection)
+
+        elif action == 'subscribe':
+            return self.handle_subscribe(connection)
+
+        elif action == 'compression':
+            return self.handle_compression(payload)
+
+        elif action == 'logout':
+            return self.handle_logout(payload)
+
+        return {"error": f"Unknown action: {action}"}
 
     def handle_client(self, client_socket, client_address):
         """
         Handle communication with a connected client.
+        Every request carries its action and payload, the response is sent back with the same
+        request id so the client can have several requests in flight.
         """
+        connection = Protocol.FramedSocket(client_socket)
         try:
-            # Receive the public key of the client and send the server's public key
-            public_client_key_pem = client_socket.recv(1024)
-            public_client_key = load_pem_public_key(public_client_key_pem)
-            client_socket.send(self.public_key_pem)
+            self.handshake(connection)
 
             while True:
-                action = client_socket.recv(1024).decode('utf-8')  # Receive the action from the client
-                print(f"Action received: {action}\n")
-                response = client_socket.send(f"Action received: {action}".encode('utf-8'))
-
-                if action == 'login':
-                    self.handle_login(client_socket)
+                request_id, action, payload = connection.recv_request()
+                if action in AUTH_ACTIONS:
+                    future = self.submit_auth_action(action, payload)
+                    response = future.result() if future else AUTH_BUSY
+                else:
+                    response = self.handle_action(action, payload, connection)
+                connection.send_response(request_id, response)
+                if action == 'compression':
+                    connection.codec = self.codecs.get(response['codec'])
+                elif action == 'login':
+                    # A failed login leaves nobody logged in, not the previous user
+                    self.set_user(connection, payload.split(',')[0] if response == 'True' else None)
+                elif action == 'logout':
+                    self.set_user(connection, None)
+                    break
 
-                elif action == 'receive_stories':
-                    self.handle_receive_stories(client_socket)
+        except Exception as e:
+            print(f"Error with client {client_address}: {e}\n")
 
-                elif action == 'register':
-                    self.handle_register(client_socket)
+        finally:
+            self.unsubscribe(connection)
+            connection.close()
+            self.release_connection()
+            print(f"Closed connection with {client_address}\n")
 
-                elif action == 'add_story':
-                    self.handle_add_story(client_socket)
+    async def handle_client_async(self, reader, writer):
+        """
+        Handle communication with a connected client as a coroutine (asyncio serving mode).
+        """
+        client_address = writer.get_extra_info('peername')
+        if not self.acquire_connection():
+            print(f"Connection limit reached, refusing {client_address}\n")
+            writer.close()
+            return
+        print(f"Connection established with {client_address}\n")
+
+        connection = Protocol.AsyncFramedStream(reader, writer)
+        try:
+            await self.handshake_async(connection)
 
+            while True:
+                request_id, action, payload = await connection.recv_request()
+                if action in AUTH_ACTIONS:
+                    # Wait for the hash without blocking the event loop
+                    future = self.submit_auth_action(action, payload)
+                    response = await asyncio.wrap_future(future) if future else AUTH_BUSY
+                else:
+                    # Store reads and writes block (fsync, SQLite, snapshot builds), they run on the
+                    # default executor so the event loop keeps serving the other connections
+                    response = await self.loop.run_in_executor(None, self.handle_action, action, payload,
+                                                               connection)
+                await connection.send_response(request_id, response)
+                if action == 'compression':
+                    connection.codec = self.codecs.get(response['codec'])
+                elif action == 'login':
+                    # A failed login leaves nobody logged in, not the previous user
+                    self.set_user(connection, payload.split(',')[0] if response == 'True' else None)
                 elif action == 'logout':
-                    self.handle_logout(client_socket)
+                    self.set_user(connection, None)
                     break
 
         except Exception as e:
             print(f"Error with client {client_address}: {e}\n")
 
         finally:
-            client_socket.close()
+            self.unsubscribe(connection)
+            connection.close()
+            self.release_connection()
             print(f"Closed connection with {client_address}\n")
 
-    def handle_login(self, client_socket):
+    def submit_auth_action(self, action, payload):
+        """
+        Run a login or register on the auth pool, away from the connection threads and the event loop.
+        Returns the Future of its response, None when the pool is full.
+        """
+        try:
+            return self.auth_pool.submit(self.handle_action, action, payload)
+        except WorkerPool.PoolFull:
+            print(f"Auth pool full, refusing {action}\n")
+            return None
+
+    def handle_login(self, credentials):
         """
         Handle user login by checking credentials.
         """
-        credentials = self.decrypt(client_socket.recv(1024)).decode()
         username, password = credentials.split(',')
         print(f"Login attempt for {username}\n")
 
         if self.sql_data_base.check_credentials(username, password):
-            client_socket.send(b'True')  # Send success response
-        else:
-            client_socket.send(b'False')  # Send failure response
+            return 'True'  # Success response
+        return 'False'  # Failure response
 
-
-
-    def handle_register(self, client_socket):
+    def handle_register(self, user_data):
         """
         Handle user registration and store new user in the database.
         """
-        user_data = self.decrypt(client_socket.recv(1024)).decode()
         first_name, username, password = user_data.split(',')
         print(f"Registering user {first_name}, {username}\n")
 
         if self.sql_data_base.create_user(first_name, username, password):
-            client_socket.send(b'Registration successful')
             self.sql_data_base.print_all_users()
-        else:
-            client_socket.send(b'Registration failed')
+            return 'Registration successful'
+        return 'Registration failed'
 
-    def handle_add_story(self, client_socket):
+    def handle_add_story(self, story):
         """
-        Handle adding a new story from the client, now including pos_x and pos_y.
+        Handle adding a new story from the client, the whole story arrives in one JSON payload
+        and the response carries the id of the new story.
         """
-        title = client_socket.recv(1024).decode()
-        client_socket.send(b'title sent successfully')
-        print(f"Received title: {title}\n")
-
-        content = client_socket.recv(1024).decode()
-        client_socket.send(b'content sent successfully')
-        print(f"Received content: {content}\n")
-
-        username = client_socket.recv(1024).decode()
-        client_socket.send(b'username sent successfully')
-        print(f"Received username: {username}\n")
-
-        pos_x = int(client_socket.recv(1024).decode())  # Receive pos_x
-        client_socket.send(b'pos_x sent successfully')
-        print(f"Received pos_x: {pos_x}\n")
-
-        pos_y = int(client_socket.recv(1024).decode())  # Receive pos_y
-        client_socket.send(b'pos_y sent successfully')
-        print(f"Received pos_y: {pos_y}\n")
+        try:
+            story = read_story(story)
+        except ValueError as e:
+            return {"error": str(e)}
+        print(f"Received story: {story['title']} at ({story['pos_x']}, {story['pos_y']})\n")
 
-        self.json_data_base.add_entry(title, content, username, pos_x, pos_y)
+        story_id = self.story_data_base.add_entry(story['title'], story['content'], story['username'],
+                                                 story['pos_x'], story['pos_y'])
         print("Story added to database.\n")
+        self.publish_event('stories_changed',
+                           self.stories_changed([dict(story, id=story_id)], [], self.story_data_base.version))
+        return {"story_id": story_id}
 
-    def handle_logout(self, client_socket):
+    def handle_add_stories(self, payload):
         """
-        Handle client logout and remove the player from the players list.
+        Handle adding a batch of stories in one request (bulk imports), none is added if one is invalid.
         """
         try:
-            # Receive the username of the player who is logging out
-            username = client_socket.recv(1024).decode('utf-8')
-            print(f"Logout request received for {username}\n")
-
-            # Handle logout logic here
+            stories = [read_story(story) for story in payload['stories']]
+        except ValueError as e:
+            return {"error": str(e)}
+        print(f"Received {len(stories)} stories\n")
+
+        story_ids = self.story_data_base.add_entries(stories)
+        print("Stories added to database.\n")
+        self.publish_event('stories_changed',
+                           self.stories_changed([dict(story, id=story_id) for story, story_id in zip(stories, story_ids)],
+                                                [], self.story_data_base.version))
+        return {"story_ids": story_ids}
+
+    def handle_delete_story(self, payload, connection=None):
+        """
+        Handle deleting a story, only the user who wrote it can delete it, logged in on this connection.
+        """
+        username = connection.username if connection else None
+        story = self.story_data_base.get_entry(payload['story_id'])
+        if username is None or story is None or story['username'] != username:
+            return {"deleted": False}
+
+        deleted = self.story_data_base.delete_entry(payload['story_id'])
+        print(f"Story {payload['story_id']} deleted.\n")
+        if deleted:
+            self.publish_event('stories_changed', self.stories_changed([], [payload['story_id']],
+                                                                       self.story_data_base.version))
+        return {"deleted": deleted}
+
+    def handle_logout(self, username):
+        """
+        Handle client logout and remove the player from the players list.
+        """
+        print(f"Logout request received for {username}\n")
 
-            # Send response back to the client
-            client_socket.send(b"Logout successful.")
+        # Handle logout logic here
 
-        except Exception as e:
-            print(f"Error during logout: {e}")
-            client_socket.send(b"Error during logout.")
+        return "Logout successful."
 
     def handle_logout_udp(self, data, client_address):
         """
@@ -305,16 +902,9 @@ class Server:
             username = data['username']
             print(f"Logout request received for {username}\n")
 
-            # Find the player in the list and remove them
-            player_found = False
-            for player in self.players:
-                if player.username == username:
-                    self.players.remove(player)
-                    player_found = True
-                    print(f"Player {username} removed from the players list.")
-                    break
-
-            if player_found:
+            # Remove the player from the registry
+            if self.players.remove(username):
+                print(f"Player {username} removed from the players list.")
                 self.udp_socket.sendto(b'Logout successful, you have been removed from the players list.', client_address)
 
             else:
@@ -1,38 +1,114 @@
 import sqlite3
 import hashlib
+import hmac
+import os
+import threading
+
+# The queries are constant strings so each connection prepares them once and reuses them from its statement cache
+SELECT_USER = 'SELECT username, password, first_name FROM users WHERE username=?'
+INSERT_USER = 'INSERT INTO users (first_name, username, password) VALUES (?, ?, ?)'
+SELECT_ALL_USERS = 'SELECT username, password, first_name FROM users'
+UPDATE_PASSWORD = 'UPDATE users SET password=? WHERE username=?'
+
+# Passwords are stored as "scrypt$n$r$p$salt$hash" with a random salt per user, so the parameters can be
+# raised later and older rows are still checked with their own. Python builds without scrypt use PBKDF2,
+# stored as "pbkdf2_sha256$iterations$salt$hash". Rows from before are a SHA-256 with a fixed salt.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+
+def hash_password(password):
+    """Hash a password with a new salt and the current parameters"""
+    salt = os.urandom(SALT_SIZE)
+    if hasattr(hashlib, 'scrypt'):
+        key = scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${key.hex()}"
+    key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS, KEY_SIZE)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${key.hex()}"
+
+
+def scrypt(password, salt, n, r, p):
+    # scrypt needs 128 * n * r * p bytes of memory, more than the default limit of OpenSSL
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p, dklen=KEY_SIZE)
+
+
+def legacy_hash(password):
+    return hashlib.sha256((password + "daddy").encode('utf-8')).hexdigest()
+
+
+def verify_password(password, stored_password):
+    """Check a password against a stored hash of any of the formats"""
+    fields = stored_password.split('$')
+    if fields[0] == 'scrypt':
+        n, r, p, salt, key = fields[1:]
+        computed = scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p))
+    elif fields[0] == 'pbkdf2_sha256':
+        iterations, salt, key = fields[1:]
+        computed = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt),
+                                       int(iterations), KEY_SIZE)
+    else:
+        return hmac.compare_digest(legacy_hash(password), stored_password)
+    return hmac.compare_digest(computed, bytes.fromhex(key))
+
+
+def needs_rehash(stored_password):
+    """True for legacy rows and for hashes made with weaker parameters than the current ones"""
+    fields = stored_password.split('$')
+    if fields[0] == 'scrypt':
+        return (int(fields[1]), int(fields[2]), int(fields[3])) < (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    if fields[0] == 'pbkdf2_sha256':
+        return hasattr(hashlib, 'scrypt') or int(fields[1]) < PBKDF2_ITERATIONS
+    return True
+
 
 class SqlDataBase:
-    def __init__(self, host='127.0.0.1', port=65432):
-        db_name = 'users.db'
+    def __init__(self, host='127.0.0.1', port=65432, db_name='users.db'):
         # Initialize the server and database connection
         self.db_name = db_name
-        self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        # Every client thread gets its own connection, so logins don't share a cursor or wait for each other
+        self.local = threading.local()
+
+        conn = self.connection()
+        # WAL lets the logins read while a new user is being written, it is a property of the database file
+        conn.execute('PRAGMA journal_mode=WAL')
 
         # Create or update the users table to include a balance column
-        self.cursor.execute('''
+        conn.execute('''
                       CREATE TABLE IF NOT EXISTS users (
                           username TEXT PRIMARY KEY,
                           password TEXT,
                           first_name TEXT
                       )
                   ''')
-        self.conn.commit()
-
+        conn.commit()
 
+    def connection(self):
+        """Return the connection of the calling thread, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # timeout: wait for another thread's write instead of failing with "database is locked"
+            conn = sqlite3.connect(self.db_name, timeout=10.0)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
 
     def check_credentials(self, username, password):
-        """Check user credentials for login"""
+        """Check user credentials for login, hashes of older formats are replaced after a successful login"""
         try:
-            # ashing password
-            password =hashlib.sha256((password + "daddy").encode('utf-8')).hexdigest()
-
-            self.cursor.execute('SELECT * FROM users WHERE username=?', (username,))
-            result = self.cursor.fetchone()
+            result = self.connection().execute(SELECT_USER, (username,)).fetchone()
             if result:
-                stored_password = result[1]  # Password stored as plain text
-                if stored_password == password:
+                stored_password = result[1]  # Salted hash with its parameters
+                if verify_password(password, stored_password):
                     print("t")
+                    if needs_rehash(stored_password):
+                        with self.connection() as conn:
+                            conn.execute(UPDATE_PASSWORD, (hash_password(password), username))
+                        print(f"Password of {username} rehashed.")
                     return True
         except Exception as e:
             print(f"Error: {e}")
@@ -42,14 +118,11 @@ class SqlDataBase:
         """Create a new user and insert into the database"""
 
         try:
-            #ashing password
-            password = hashlib.sha256((password + "daddy").encode('utf-8')).hexdigest()
-
-            self.cursor.execute(
-                'INSERT INTO users (first_name, username, password) VALUES (?, ?, ?)',
-                (first_name, username, password)
-            )
-            self.conn.commit()
+            # Hashing password
+            password = hash_password(password)
+
+            with self.connection() as conn:
+                conn.execute(INSERT_USER, (first_name, username, password))
             print("User created successfully.")
             return True
         except sqlite3.IntegrityError:
@@ -62,8 +135,7 @@ class SqlDataBase:
     def print_all_users(self):
         """Print all users in the database, including their balance"""
         try:
-            self.cursor.execute('SELECT * FROM users')
-            rows = self.cursor.fetchall()
+            rows = self.connection().execute(SELECT_ALL_USERS).fetchall()
             if rows:
                 print("Users in the database:")
                 for row in rows:
@@ -72,5 +144,3 @@ class SqlDataBase:
                 print("No users found in the database.")
         except Exception as e:
             print(f"Error retrieving users: {e}")
-
-
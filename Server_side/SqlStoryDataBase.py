@@ -0,0 +1,239 @@
+import sqlite3
+import threading
+from Server_side import jsonDataBase
+from Shared import StoryColumns
+
+
+class SqlStoryDataBase:
+    """
+    Story storage in SQLite with the same interface as jsonDataBase.
+    Stories get an autoincrement id and their positions are indexed in an R*Tree,
+    so the stories never have to be held in memory all at once.
+    Every change gets the next version number and deleted stories leave a tombstone.
+    Writes go through one connection behind a lock, each thread reads through its own connection, so with WAL
+    the reads neither wait for the lock nor for a write in progress.
+    """
+
+    def __init__(self, db_name='stories.db'):
+        self.db_name = db_name
+        self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        self.lock = threading.Lock()  # The write connection is shared by all the client threads
+        self.local = threading.local()  # The read connection of each thread
+
+        # WAL lets readers continue while a story is being written
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+
+        self.conn.execute('''
+                      CREATE TABLE IF NOT EXISTS stories (
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          title TEXT,
+                          content TEXT,
+                          username TEXT,
+                          pos_x INTEGER,
+                          pos_y INTEGER,
+                          version INTEGER
+                      )
+                  ''')
+        # Databases made before versions existed, the ids of their stories are their versions
+        if 'version' not in [column[1] for column in self.conn.execute('PRAGMA table_info(stories)')]:
+            self.conn.execute('ALTER TABLE stories ADD COLUMN version INTEGER')
+            self.conn.execute('UPDATE stories SET version = id')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS stories_version ON stories (version)')
+        self.conn.execute('''
+                      CREATE TABLE IF NOT EXISTS tombstones (
+                          id INTEGER PRIMARY KEY,
+                          version INTEGER
+                      )
+                  ''')
+        # Spatial index of the story positions, a story is a point so min == max
+        self.conn.execute('''
+                      CREATE VIRTUAL TABLE IF NOT EXISTS stories_index USING rtree_i32(
+                          id, min_x, max_x, min_y, max_y
+                      )
+                  ''')
+        self.conn.commit()
+
+        self.version = self.conn.execute(
+            'SELECT MAX(IFNULL((SELECT MAX(version) FROM stories), 0), IFNULL((SELECT MAX(version) FROM tombstones), 0))'
+        ).fetchone()[0]
+
+    def connection(self):
+        """Return the read connection of the calling thread, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_name, timeout=10.0)
+            self.local.conn = conn
+        return conn
+
+    def insert(self, title, content, username, pos_x, pos_y, version, story_id=None):
+        """
+        Insert one story and its index entry (the caller holds the lock and commits). Returns the story id.
+        self.version is only raised by the caller after the commit, so readers never see a version before its rows.
+        """
+        cursor = self.conn.execute(
+            'INSERT INTO stories (id, title, content, username, pos_x, pos_y, version) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (story_id, title.strip(), content.strip(), username.strip(), pos_x, pos_y, version)
+        )
+        story_id = cursor.lastrowid
+        self.conn.execute(
+            'INSERT INTO stories_index (id, min_x, max_x, min_y, max_y) VALUES (?, ?, ?, ?, ?)',
+            (story_id, pos_x, pos_x, pos_y, pos_y)
+        )
+        return story_id
+
+    def add_entry(self, title, content, username, pos_x, pos_y):
+        """
+        Adds a story and returns its id, raises ValueError if the story can't be stored.
+        """
+        if not StoryColumns.is_valid_story(title, content, username, pos_x, pos_y):
+            raise ValueError("Invalid story")
+        with self.lock:
+            with self.conn:
+                story_id = self.insert(title, content, username, pos_x, pos_y, self.version + 1)
+            self.version += 1
+        return story_id
+
+    def add_entries(self, stories):
+        """
+        Adds many stories (dicts with title, content, username, pos_x and pos_y) in one transaction.
+        Returns the ids of the new stories in the same order, raises ValueError if one of them can't be stored.
+        """
+        if not all(StoryColumns.is_valid_story(story.get('title'), story.get('content'), story.get('username'),
+                                               story.get('pos_x'), story.get('pos_y')) for story in stories):
+            raise ValueError("Invalid story")
+        with self.lock:
+            with self.conn:
+                story_ids = [self.insert(story['title'], story['content'], story['username'], story['pos_x'],
+                                         story['pos_y'], self.version + 1 + index)
+                             for index, story in enumerate(stories)]
+            self.version += len(story_ids)
+        return story_ids
+
+    def delete_entry(self, story_id):
+        """
+        Deletes a story and leaves a tombstone for it. Returns False if there is no such story.
+        """
+        with self.lock:
+            with self.conn:
+                if self.conn.execute('DELETE FROM stories WHERE id = ?', (story_id,)).rowcount == 0:
+                    return False
+                self.conn.execute('DELETE FROM stories_index WHERE id = ?', (story_id,))
+                self.conn.execute('INSERT INTO tombstones (id, version) VALUES (?, ?)', (story_id, self.version + 1))
+            self.version += 1
+        return True
+
+    def get_entry(self, story_id):
+        """
+        Returns the story with this id, None if there is none.
+        """
+        row = self.connection().execute(
+            'SELECT id, title, content, username, pos_x, pos_y, version FROM stories WHERE id = ?', (story_id,)
+        ).fetchone()
+        return None if row is None else self.row_to_entry(row)
+
+    @staticmethod
+    def row_to_entry(row):
+        return {"id": row[0], "title": row[1], "content": row[2], "username": row[3], "pos_x": row[4],
+                "pos_y": row[5], "version": row[6]}
+
+    def get_data(self):
+        """
+        Returns all the stories as dicts, like jsonDataBase.get_data.
+        """
+        rows = self.connection().execute(
+            'SELECT id, title, content, username, pos_x, pos_y, version FROM stories ORDER BY id'
+        ).fetchall()
+        return [self.row_to_entry(row) for row in rows]
+
+    def sample_texts(self, limit):
+        """
+        Returns the title and content of the newest stories, at most limit of them.
+        """
+        rows = self.connection().execute(
+            'SELECT title, content FROM stories ORDER BY id DESC LIMIT ?', (limit,)
+        ).fetchall()
+        return [title + '\n' + content for title, content in rows]
+
+    def receive_data(self):
+        """
+        Returns five lists: titles, contents, usernames, pos_x and pos_y.
+        """
+        rows = self.connection().execute(
+            'SELECT title, content, username, pos_x, pos_y FROM stories ORDER BY id'
+        ).fetchall()
+        if not rows:
+            return [], [], [], [], []
+        return tuple(list(column) for column in zip(*rows))
+
+    def snapshot_columns(self):
+        """
+        Returns every story in the columnar wire encoding.
+        """
+        return StoryColumns.pack_entries(self.get_data())
+
+    def query_region(self, min_x, min_y, max_x, max_y, limit=None, after_id=0, since=0):
+        """
+        Returns the stories inside the rectangle with an id greater than after_id and a version greater than
+        since, ordered by id, at most limit of them (None for all). The R*Tree finds them without scanning the table.
+        """
+        rows = self.connection().execute(
+            '''
+            SELECT stories.id, title, content, username, pos_x, pos_y, version
+            FROM stories_index JOIN stories ON stories.id = stories_index.id
+            WHERE min_x >= ? AND max_x <= ? AND min_y >= ? AND max_y <= ? AND stories.id > ? AND version > ?
+            ORDER BY stories.id LIMIT ?
+            ''',
+            (int(min_x), int(max_x), int(min_y), int(max_y), after_id, since, -1 if limit is None else limit)
+        ).fetchall()
+        return [self.row_to_entry(row) for row in rows]
+
+    def query_since(self, since, limit=None, after_id=0):
+        """
+        Returns the stories with a version greater than since and an id greater than after_id, ordered by id,
+        at most limit of them (None for all).
+        """
+        rows = self.connection().execute(
+            'SELECT id, title, content, username, pos_x, pos_y, version FROM stories '
+            'WHERE version > ? AND id > ? ORDER BY id LIMIT ?',
+            (since, after_id, -1 if limit is None else limit)
+        ).fetchall()
+        return [self.row_to_entry(row) for row in rows]
+
+    def tombstones_since(self, since):
+        """
+        Returns the ids of the stories deleted after version since.
+        """
+        rows = self.connection().execute('SELECT id FROM tombstones WHERE version > ?', (since,)).fetchall()
+        return [row[0] for row in rows]
+
+    def migrate_from_json(self, filename='data.json'):
+        """
+        One-shot import of the stories of data.json and its journals, story ids are kept.
+        The database remembers it was migrated (user_version) so later starts skip it.
+        """
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] >= 1:
+            return 0
+
+        # Loaded the way the JSON store loads itself: the snapshot, the journals of an interrupted
+        # compaction and the current journal, with the same checks on every record
+        json_store = jsonDataBase.jsonDataBase(filename, maintenance=False)
+        entries = json_store.get_data()
+        deleted = list(json_store.tombstones)
+        json_store.close()
+
+        with self.lock:
+            version = self.version
+            with self.conn:
+                for entry in entries:
+                    version += 1
+                    self.insert(entry['title'], entry['content'], entry['username'], entry['pos_x'], entry['pos_y'],
+                                version, entry['id'])
+                for story_id in deleted:
+                    version += 1
+                    self.conn.execute('INSERT OR IGNORE INTO tombstones (id, version) VALUES (?, ?)',
+                                      (story_id, version))
+                self.conn.execute('PRAGMA user_version = 1')
+            self.version = version
+        print(f"Migrated {len(entries)} stories from {filename} to {self.db_name}.")
+        return len(entries)
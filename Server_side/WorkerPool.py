@@ -0,0 +1,30 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolFull(Exception):
+    """Raised by submit when max_pending tasks are already waiting or running."""
+
+
+class WorkerPool:
+    """
+    A thread pool with a limit on the tasks waiting or running in it. Past the limit submit refuses
+    the task instead of queueing it, so a flood of expensive requests (password hashing) can't pile up
+    and take the server's time from the other clients.
+    """
+
+    def __init__(self, workers=2, max_pending=32, name='worker'):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.rejected = 0
+
+    def submit(self, function, *args):
+        """
+        Run function(*args) on the pool, returns its Future. Raises PoolFull when the pool is full.
+        """
+        if not self.slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PoolFull("Too many tasks waiting")
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
@@ -1,8 +1,37 @@
+import bisect
 import json
+import os
+import threading
+import time
+from Shared import SpatialGrid, StoryColumns
+
+# fsync policies of the journal
+FSYNC_ALWAYS = "always"  # fsync after every write, a story is durable once add_entry returns
+FSYNC_INTERVAL = "interval"  # fsync in the background every fsync_interval seconds
+FSYNC_NEVER = "never"  # leave it to the operating system
+
 
 class jsonDataBase:
-    def __init__(self, filename="data.json"):
+    """
+    Story storage made of a JSON snapshot (data.json) and an append-only JSON-lines journal.
+    A new story costs one appended line, a background thread compacts the journal into a new
+    snapshot, and startup replays the journal on top of the snapshot.
+    Compaction moves the journal aside (data.json.journal.<n>) and starts a new one, so stories keep being
+    added while the snapshot is written; the old journals are deleted once the snapshot has replaced data.json.
+    Every change gets the next version number and deleted stories leave a tombstone,
+    so clients can ask for the changes since the version they have.
+    In memory the stories are kept as columns (StoryColumns) rather than one dict per story.
+    """
+
+    def __init__(self, filename="data.json", fsync=FSYNC_ALWAYS, fsync_interval=1.0, compact_interval=60.0,
+                 maintenance=True):
         self.filename = filename
+        self.journal_filename = filename + ".journal"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_interval = compact_interval
+        self.lock = threading.Lock()
+
         try:
             # Try to load existing JSON data from the file
             with open(self.filename, 'r') as file:
@@ -11,40 +40,308 @@ class jsonDataBase:
             # If the file doesn't exist or is empty, initialize with an empty list
             self.data = []
 
-    def add_entry(self, title, content, username, pos_x, pos_y):
+        # Give stories saved before ids existed an id, new stories continue after the highest one
+        self.next_id = max((entry.get('id', 0) for entry in self.data), default=0) + 1
+        for entry in self.data:
+            if 'id' not in entry:
+                entry['id'] = self.next_id
+                self.next_id += 1
+
+        # Stories saved before versions existed get their id as version, ids only grow too
+        for entry in self.data:
+            entry.setdefault('version', entry['id'])
+        self.tombstones = {entry['id']: entry['version'] for entry in self.data if entry.get('deleted')}  # id -> version
+        self.data = [entry for entry in self.data if not entry.get('deleted')]
+        self.version = max(self.next_id - 1, max(self.tombstones.values(), default=0),
+                           max((entry['version'] for entry in self.data), default=0))
+
+        # Journals moved aside by a compaction that didn't finish are replayed first, oldest first
+        rotated = self.rotated_journals()
+        self.journal_generation = rotated[-1][0] + 1 if rotated else 1
+        self.journal_records = sum(self.replay_journal(filename) for _, filename in rotated)
+        self.journal_records += self.replay_journal(self.journal_filename)
+
+        # The stories as columns in id order, and their positions in a spatial grid for region queries
+        self.stories = StoryColumns.StoryColumns()
+        self.grid = SpatialGrid.SpatialGrid()
+        for entry in sorted(self.data, key=lambda entry: entry['id']):
+            self.index_entry(entry)
+        del self.data
+
+        self.journal = open(self.journal_filename, 'a', encoding='utf-8')
+        self.unsynced = False
+
+        # Background thread for the fsync interval policy and the periodic compaction,
+        # without it the store is only read (migrate_from_json)
+        if maintenance:
+            maintenance_thread = threading.Thread(target=self.run_maintenance)
+            maintenance_thread.daemon = True
+            maintenance_thread.start()
+
+    def close(self):
+        with self.lock:
+            self.journal.close()
+
+    def rotated_journals(self):
         """
-        Adds an entry with a title, content, username, pos_x, and pos_y to the JSON data.
+        Returns (generation, filename) of the journals moved aside by compactions, oldest first.
+        """
+        directory = os.path.dirname(self.journal_filename) or '.'
+        prefix = os.path.basename(self.journal_filename) + '.'
+        rotated = []
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                rotated.append((int(name[len(prefix):]), os.path.join(os.path.dirname(self.journal_filename), name)))
+        return sorted(rotated)
+
+    def replay_journal(self, filename):
         """
+        Add the stories of a journal that are not in the snapshot yet, returns how many records it holds.
+        """
+        known_ids = {entry['id'] for entry in self.data} | set(self.tombstones)
+        records = 0
+        skipped = 0
+        valid_length = 0
+        try:
+            with open(filename, 'rb') as journal:
+                for line in journal:
+                    if not line.endswith(b'\n'):
+                        # Only the last line can miss its newline: the server was killed in the middle of
+                        # this write, cut it off so new records are not appended to it
+                        print(f"Dropping a truncated record at the end of {filename}.")
+                        journal.close()
+                        os.truncate(filename, valid_length)
+                        break
+                    valid_length += len(line)
+                    records += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A damaged record in the middle, the records after it are still good
+                        skipped += 1
+                        continue
+                    if not self.is_valid_record(entry):
+                        # Written before the stories were validated, it would stop every start
+                        skipped += 1
+                        continue
+                    if entry['id'] in self.tombstones:  # Already in the snapshot if compaction was interrupted
+                        continue
+                    if entry.get('deleted'):
+                        self.data = [story for story in self.data if story['id'] != entry['id']]
+                        self.tombstones[entry['id']] = entry['version']
+                    elif entry['id'] not in known_ids:
+                        self.data.append(entry)
+                        known_ids.add(entry['id'])
+                        self.next_id = max(self.next_id, entry['id'] + 1)
+                    self.version = max(self.version, entry['version'])
+        except FileNotFoundError:
+            pass
+        if skipped:
+            print(f"Skipped {skipped} unreadable or invalid records of {filename}.")
+        return records
+
+    @staticmethod
+    def is_valid_record(entry):
+        if not isinstance(entry, dict) or not StoryColumns.is_int32(entry.get('id')) \
+                or not StoryColumns.is_int32(entry.get('version')):
+            return False
+        return entry.get('deleted') is True or StoryColumns.is_valid_story(
+            entry.get('title'), entry.get('content'), entry.get('username'), entry.get('pos_x'), entry.get('pos_y'))
+
+    def make_entry(self, title, content, username, pos_x, pos_y):
+        """
+        Builds a new entry with the next story id.
+        """
+        self.version += 1
         entry = {
+            "id": self.next_id,
+            "version": self.version,
             "title": title.strip(),
             "content": content.strip(),
             "username": username.strip(),
             "pos_x": pos_x,
             "pos_y": pos_y
         }
-        self.data.append(entry)
-        self.save()
+        self.next_id += 1
+        return entry
+
+    def add_entry(self, title, content, username, pos_x, pos_y):
+        """
+        Adds an entry with a title, content, username, pos_x, and pos_y to the JSON data.
+        Returns the id of the new story, raises ValueError if the story can't be stored.
+        """
+        if not StoryColumns.is_valid_story(title, content, username, pos_x, pos_y):
+            raise ValueError("Invalid story")
+        with self.lock:
+            entry = self.make_entry(title, content, username, pos_x, pos_y)
+            self.append_to_journal([entry])
+            self.index_entry(entry)
+        return entry['id']
+
+    def add_entries(self, stories):
+        """
+        Adds many stories (dicts with title, content, username, pos_x and pos_y) with a single journal write.
+        Returns the ids of the new stories in the same order, raises ValueError if one of them can't be stored.
+        Nothing is written unless every story is valid.
+        """
+        if not all(StoryColumns.is_valid_story(story.get('title'), story.get('content'), story.get('username'),
+                                               story.get('pos_x'), story.get('pos_y')) for story in stories):
+            raise ValueError("Invalid story")
+        with self.lock:
+            entries = [self.make_entry(story['title'], story['content'], story['username'],
+                                       story['pos_x'], story['pos_y']) for story in stories]
+            self.append_to_journal(entries)
+            for entry in entries:
+                self.index_entry(entry)
+        return [entry['id'] for entry in entries]
+
+    def delete_entry(self, story_id):
+        """
+        Deletes a story and leaves a tombstone for it. Returns False if there is no such story.
+        """
+        with self.lock:
+            if self.stories.index_of(story_id) is None:
+                return False
+            self.version += 1
+            self.append_to_journal([{"id": story_id, "version": self.version, "deleted": True}])
+            self.stories.remove(story_id)
+            self.grid.remove(story_id)
+            self.tombstones[story_id] = self.version
+        return True
+
+    def get_entry(self, story_id):
+        """
+        Returns the story with this id, None if there is none.
+        """
+        with self.lock:
+            index = self.stories.index_of(story_id)
+            return None if index is None else self.stories.row(index)
+
+    def index_entry(self, entry):
+        self.stories.append(entry)
+        self.grid.move(entry['id'], entry['pos_x'], entry['pos_y'])
+
+    def append_to_journal(self, entries):
+        """
+        Write one line per entry at the end of the journal and sync it according to the fsync policy.
+        """
+        self.journal.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        self.journal.flush()
+        if self.fsync == FSYNC_ALWAYS:
+            os.fsync(self.journal.fileno())
+        else:
+            self.unsynced = True
+        self.journal_records += len(entries)
 
     def get_data(self):
         """
         Returns all the entries in the JSON data.
         """
-        return self.data
+        with self.lock:
+            return self.stories.rows()
+
+    def sample_texts(self, limit):
+        """
+        Returns the title and content of the newest stories, at most limit of them.
+        """
+        with self.lock:
+            start = max(0, len(self.stories) - limit)
+            strings = self.stories.strings.strings
+            return [strings[title] + '\n' + strings[content]
+                    for title, content in zip(self.stories.titles[start:], self.stories.contents[start:])]
 
     def receive_data(self):
         """
-        Returns four lists: one for titles, one for contents, one for usernames, and one for positions.
+        Returns five lists: titles, contents, usernames, pos_x and pos_y.
+        """
+        with self.lock:
+            return tuple(self.stories.column(name) for name in ('titles', 'contents', 'usernames', 'pos_x', 'pos_y'))
+
+    def snapshot_columns(self):
+        """
+        Returns every story in the columnar wire encoding, a copy of the columns.
         """
-        titles = [entry['title'] for entry in self.data]
-        contents = [entry['content'] for entry in self.data]
-        usernames = [entry['username'] for entry in self.data]
-        pos_x = [entry['pos_x'] for entry in self.data]
-        pos_y = [entry['pos_y'] for entry in self.data]
-        return titles, contents, usernames, pos_x, pos_y
+        with self.lock:
+            return self.stories.pack()
+
+    def query_region(self, min_x, min_y, max_x, max_y, limit=None, after_id=0, since=0):
+        """
+        Returns the stories inside the rectangle with an id greater than after_id and a version greater than
+        since, ordered by id, at most limit of them (None for all).
+        """
+        with self.lock:
+            indexes = sorted(self.stories.index_of(story_id)
+                             for story_id in self.grid.query_rect(min_x, min_y, max_x, max_y) if story_id > after_id)
+            indexes = [index for index in indexes if self.stories.versions[index] > since]
+            if limit is not None:
+                indexes = indexes[:limit]
+            return [self.stories.row(index) for index in indexes]
+
+    def query_since(self, since, limit=None, after_id=0):
+        """
+        Returns the stories with a version greater than since and an id greater than after_id, ordered by id,
+        at most limit of them (None for all).
+        """
+        with self.lock:
+            # Stories are appended in id order and get growing versions, so both columns are sorted
+            start = max(bisect.bisect_right(self.stories.versions, since),
+                        bisect.bisect_right(self.stories.ids, after_id))
+            return self.stories.rows(start, None if limit is None else min(start + limit, len(self.stories)))
+
+    def tombstones_since(self, since):
+        """
+        Returns the ids of the stories deleted after version since.
+        """
+        with self.lock:
+            return [story_id for story_id, version in self.tombstones.items() if version > since]
+
+    def run_maintenance(self):
+        """
+        Sync the journal every fsync_interval seconds (interval policy) and compact it every compact_interval.
+        """
+        last_compaction = time.time()
+        while True:
+            time.sleep(min(self.fsync_interval, self.compact_interval))
+            try:
+                if self.fsync == FSYNC_INTERVAL and self.unsynced:
+                    with self.lock:
+                        os.fsync(self.journal.fileno())
+                        self.unsynced = False
+
+                if time.time() - last_compaction >= self.compact_interval:
+                    last_compaction = time.time()
+                    if self.journal_records:
+                        self.save()
+            except Exception as e:
+                print(f"Error during journal maintenance: {e}")
 
     def save(self):
         """
-        Saves the JSON data to the file.
+        Compaction: write every story to a new snapshot and drop the journals it covers.
+        Under the lock the stories are copied and the journal is moved aside for a new one, the snapshot is
+        written without it. It is written to a temporary file and renamed, so a crash leaves either the old
+        snapshot and its journals or the new one.
         """
-        with open(self.filename, 'w') as file:
-            json.dump(self.data, file, indent=4)
+        with self.lock:
+            # Tombstones are kept in the snapshot for the clients that have not seen them yet
+            entries = self.stories.rows() + [{"id": story_id, "version": version, "deleted": True}
+                                             for story_id, version in self.tombstones.items()]
+            if self.unsynced:
+                os.fsync(self.journal.fileno())
+            self.journal.close()
+            os.replace(self.journal_filename, f"{self.journal_filename}.{self.journal_generation}")
+            self.journal_generation += 1
+            self.journal = open(self.journal_filename, 'a', encoding='utf-8')
+            self.journal_records = 0
+            self.unsynced = False
+            old_journals = [filename for _, filename in self.rotated_journals()]
+
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as file:
+            json.dump(entries, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, self.filename)
+        for filename in old_journals:
+            os.remove(filename)
+        print(f"Compacted {len(entries)} stories and tombstones into {self.filename}.")
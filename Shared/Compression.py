@@ -0,0 +1,122 @@
+import hashlib
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always there
+    zstandard = None
+
+# Flags added to the payload type of a compressed payload, so the receiver knows how to decompress it
+ZLIB = 0x40
+ZSTD = 0x80
+FLAGS = ZLIB | ZSTD
+
+COMPRESS_THRESHOLD = 512  # Smaller payloads are sent as they are
+DICTIONARY_SIZE = 16 * 1024
+MIN_DICTIONARY_SAMPLES = 100  # Fewer stories than this are not worth a dictionary
+MAX_DICTIONARY_SAMPLES = 5000  # Stories the dictionary is trained on, the newest ones
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+
+class DecompressionError(Exception):
+    """
+    A payload that is corrupt or decompresses to more than the allowed size.
+    """
+
+
+class ZlibCodec:
+    name = 'zlib'
+    flag = ZLIB
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, max_size=MAX_DECOMPRESSED_SIZE):
+        decompressor = zlib.decompressobj()
+        try:
+            result = decompressor.decompress(data, max_size)
+        except zlib.error as e:
+            raise DecompressionError(str(e))
+        if decompressor.unconsumed_tail:
+            raise DecompressionError(f"Payload decompresses to more than {max_size} bytes")
+        if not decompressor.eof:
+            raise DecompressionError("Truncated payload")
+        return result
+
+
+class ZstdCodec:
+    """
+    zstd, with a dictionary trained on story text if one is given (both sides need the same one).
+    zstd compressor objects can't be used by two threads at once, every thread gets its own.
+    """
+    name = 'zstd'
+    flag = ZSTD
+
+    def __init__(self, dictionary=None, level=3):
+        self.dictionary = dictionary
+        self.dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        self.level = level
+        self.local = threading.local()
+
+    def compress(self, data):
+        compressor = getattr(self.local, 'compressor', None)
+        if compressor is None:
+            compressor = self.local.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dict_data)
+        return compressor.compress(data)
+
+    def decompress(self, data, max_size=MAX_DECOMPRESSED_SIZE):
+        """
+        compress() writes the content size in the frame header, it is checked against max_size before
+        anything is allocated for the output.
+        """
+        decompressor = getattr(self.local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self.local.decompressor = zstandard.ZstdDecompressor(dict_data=self.dict_data)
+        try:
+            content_size = zstandard.frame_content_size(data)
+            if content_size < 0:
+                raise DecompressionError("Payload without its content size")
+            if content_size > max_size:
+                raise DecompressionError(f"Payload decompresses to more than {max_size} bytes")
+            return decompressor.decompress(data)
+        except zstandard.ZstdError as e:
+            raise DecompressionError(str(e))
+
+
+def available_codecs():
+    """
+    Names of the codecs this side supports, the preferred one first.
+    """
+    return ['zstd', 'zlib'] if zstandard else ['zlib']
+
+
+def train_dictionary(texts):
+    """
+    Train a zstd dictionary on story texts, None when zstd is missing or there are too few stories.
+    """
+    if zstandard is None or len(texts) < MIN_DICTIONARY_SAMPLES:
+        return None
+    try:
+        return zstandard.train_dictionary(DICTIONARY_SIZE, [text.encode('utf-8') for text in texts]).as_bytes()
+    except zstandard.ZstdError as e:
+        print(f"Could not train a zstd dictionary: {e}")
+        return None
+
+
+def dictionary_id(dictionary):
+    """
+    Short name of a dictionary, a client that already has it doesn't need it sent again.
+    """
+    return hashlib.sha256(dictionary).hexdigest() if dictionary else None
+
+
+def make_codec(name, dictionary=None):
+    if name == 'zstd':
+        return ZstdCodec(dictionary)
+    if name == 'zlib':
+        return ZlibCodec()
+    return None
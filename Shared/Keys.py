@@ -0,0 +1,53 @@
+import os
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+
+
+def load_or_create_private_key(path):
+    """
+    Load the RSA private key saved in path, generate and save it the first time.
+    """
+    try:
+        with open(path, 'rb') as file:
+            return serialization.load_pem_private_key(file.read(), password=None)
+    except FileNotFoundError:
+        pass
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    # Only the owner may read the private key
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as file:
+        file.write(pem)
+    print(f"Generated a new key pair in {path}")
+    return private_key
+
+
+def public_key_der(public_key):
+    return public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+
+def load_pinned_public_key(path, pem):
+    """
+    Trust on first use: save the public key PEM in path the first time, later only accept the same key.
+    Returns the public key, raises ValueError if it differs from the saved one.
+    """
+    public_key = serialization.load_pem_public_key(pem)
+    try:
+        with open(path, 'rb') as file:
+            known_key = serialization.load_pem_public_key(file.read())
+    except FileNotFoundError:
+        with open(path, 'wb') as file:
+            file.write(pem)
+        print(f"Saved the server's public key in {path}")
+        return public_key
+
+    if public_key_der(known_key) != public_key_der(public_key):
+        raise ValueError(f"The server's public key differs from the one saved in {path}")
+    return public_key
@@ -0,0 +1,430 @@
+import json
+import os
+import struct
+import threading
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from Shared import Compression
+
+# Every TCP message is a header (body length, message type) followed by the body
+HEADER = struct.Struct('!IB')
+
+# A request body starts with (request id, payload type, action length) followed by the action and the payload
+REQUEST_HEADER = struct.Struct('!IBH')
+# A response body starts with (request id, payload type) followed by the payload
+RESPONSE_HEADER = struct.Struct('!IB')
+# An event body starts with (payload type, event name length) followed by the event name and the payload
+EVENT_HEADER = struct.Struct('!BH')
+
+# Message types
+TEXT = 1  # UTF-8 text
+JSON = 2  # UTF-8 encoded JSON document
+BYTES = 3  # Raw bytes (keys, encrypted data)
+REQUEST = 4  # An action with its payload, tagged with a request id
+RESPONSE = 5  # The payload answering the request with the same id
+RESUME = 6  # Session ticket + client nonce sent instead of the key exchange, answered with b'1' + server nonce or b'0'
+EVENT = 7  # Pushed by the server to subscribed clients, not an answer to any request
+
+
+# Largest body accepted, checked from the header before the body is read. Before the session starts only
+# the handshake is exchanged (public key, encrypted session key, ticket), which is far smaller.
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+MAX_HANDSHAKE_MESSAGE_SIZE = 16 * 1024
+
+SESSION_KEY_SIZE = 32  # AES-256
+NONCE_SIZE = 12
+TICKET_SIZE = 16
+RESUME_NONCE_SIZE = 16
+
+
+class ProtocolError(Exception):
+    """Raised when the peer sends a message that does not follow the protocol."""
+
+
+def make_session_key():
+    return AESGCM.generate_key(bit_length=SESSION_KEY_SIZE * 8)
+
+
+def derive_key(key, info, length=SESSION_KEY_SIZE, salt=None):
+    return HKDF(algorithm=hashes.SHA256(), length=length, salt=salt, info=info).derive(key)
+
+
+def make_resume_nonce():
+    return os.urandom(RESUME_NONCE_SIZE)
+
+
+def resumed_session_key(session_key, client_nonce, server_nonce):
+    """
+    The key of a resumed connection: new for every connection thanks to the nonces of both sides,
+    so the messages of an earlier connection can't be replayed into it.
+    """
+    return derive_key(session_key, b'resumed session', salt=client_nonce + server_nonce)
+
+
+class SessionCipher:
+    """
+    AES-GCM encryption of message bodies with keys derived from the session key agreed in the handshake,
+    one key per direction so a message can't be reflected back to its sender.
+    The nonce of a message is its sequence number in its direction and is not sent: a message that is
+    replayed, dropped or reordered doesn't decrypt. The message type is authenticated with the body
+    so it can't be swapped.
+    """
+
+    def __init__(self, key, server=False):
+        client_key = derive_key(key, b'client to server')
+        server_key = derive_key(key, b'server to client')
+        self.send_aead = AESGCM(server_key if server else client_key)
+        self.recv_aead = AESGCM(client_key if server else server_key)
+        self.send_sequence = 0
+        self.recv_sequence = 0
+
+    def encrypt(self, msg_type, body):
+        """
+        Encrypt the next message to send, messages must be sent in the order they are encrypted.
+        """
+        nonce = self.send_sequence.to_bytes(NONCE_SIZE, 'big')
+        self.send_sequence += 1
+        return self.send_aead.encrypt(nonce, body, bytes((msg_type,)))
+
+    def decrypt(self, msg_type, body):
+        nonce = self.recv_sequence.to_bytes(NONCE_SIZE, 'big')
+        try:
+            body = self.recv_aead.decrypt(nonce, body, bytes((msg_type,)))
+        except InvalidTag:
+            raise ProtocolError("Message failed authentication (tampered, replayed or out of order)") from None
+        self.recv_sequence += 1
+        return body
+
+
+def check_length(length, max_size):
+    if length > max_size:
+        raise ProtocolError(f"Message of {length} bytes is over the limit of {max_size}")
+
+
+def pack_message(msg_type, body):
+    """
+    Return the framed bytes (header + body) of a message.
+    """
+    return HEADER.pack(len(body), msg_type) + body
+
+
+def encode_json(data):
+    # Raw UTF-8, Hebrew text would cost 6 bytes per character as \u escapes
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def decode_json(body):
+    """
+    Parse a JSON body, body may be bytes or a memoryview into a receive buffer.
+    """
+    return json.loads(str(body, 'utf-8'))
+
+
+class EncodedPayload:
+    """
+    A payload encoded ahead of time, sent as it is (cached responses).
+    Its compressed form is also made only once per codec.
+    """
+    __slots__ = ('payload_type', 'data', 'compressed')
+
+    def __init__(self, value):
+        self.payload_type, self.data = encode_payload(value)
+        self.compressed = {}  # codec -> (payload type, bytes)
+
+    def __len__(self):
+        return len(self.data)
+
+    def encoded(self, codec):
+        if codec is None:
+            return self.payload_type, self.data
+        encoded = self.compressed.get(codec)
+        if encoded is None:
+            encoded = self.compressed[codec] = compress_payload(self.payload_type, self.data, codec)
+        return encoded
+
+
+def compress_payload(payload_type, data, codec):
+    """
+    Compress a payload with the codec of the connection if that is worth it, the codec's flag
+    is added to the payload type.
+    """
+    if codec is not None and len(data) >= Compression.COMPRESS_THRESHOLD:
+        compressed = codec.compress(data)
+        if len(compressed) < len(data):
+            return payload_type | codec.flag, compressed
+    return payload_type, data
+
+
+def encode_payload(value, codec=None):
+    """
+    Return (payload type, bytes) for a str, bytes, JSON serialisable value or an EncodedPayload,
+    compressed with codec if one is given.
+    """
+    if isinstance(value, EncodedPayload):
+        return value.encoded(codec)
+    if isinstance(value, (bytes, bytearray)):
+        payload_type, data = BYTES, bytes(value)
+    elif isinstance(value, str):
+        payload_type, data = TEXT, value.encode('utf-8')
+    else:
+        payload_type, data = JSON, encode_json(value)
+    return compress_payload(payload_type, data, codec)
+
+
+def decode_payload(payload_type, body, codec=None):
+    """
+    Inverse of encode_payload.
+    """
+    flag = payload_type & Compression.FLAGS
+    if flag:
+        if codec is None or codec.flag != flag:
+            raise ProtocolError(f"Payload compressed with a codec that was not negotiated ({flag})")
+        try:
+            body = codec.decompress(body, MAX_MESSAGE_SIZE)
+        except Compression.DecompressionError as e:
+            raise ProtocolError(f"Could not decompress the payload: {e}")
+        payload_type &= ~Compression.FLAGS
+    if payload_type == TEXT:
+        return str(body, 'utf-8')
+    if payload_type == JSON:
+        return decode_json(body)
+    if payload_type == BYTES:
+        return bytes(body)
+    raise ProtocolError(f"Unknown payload type {payload_type}")
+
+
+def pack_request(request_id, action, payload, codec=None):
+    payload_type, payload_bytes = encode_payload(payload, codec)
+    action_bytes = action.encode('utf-8')
+    return REQUEST_HEADER.pack(request_id, payload_type, len(action_bytes)) + action_bytes + payload_bytes
+
+
+def unpack_request(body, codec=None):
+    """
+    Returns (request id, action, payload) of a request body.
+    """
+    request_id, payload_type, action_length = REQUEST_HEADER.unpack_from(body)
+    action_end = REQUEST_HEADER.size + action_length
+    action = str(body[REQUEST_HEADER.size:action_end], 'utf-8')
+    return request_id, action, decode_payload(payload_type, body[action_end:], codec)
+
+
+def pack_response(request_id, payload, codec=None):
+    payload_type, payload_bytes = encode_payload(payload, codec)
+    return RESPONSE_HEADER.pack(request_id, payload_type) + payload_bytes
+
+
+def unpack_response(body, codec=None):
+    """
+    Returns (request id, payload) of a response body.
+    """
+    request_id, payload_type = RESPONSE_HEADER.unpack_from(body)
+    return request_id, decode_payload(payload_type, body[RESPONSE_HEADER.size:], codec)
+
+
+def pack_event(event, payload, codec=None):
+    """
+    Pack an event body, it can then be sent to every subscriber using the same codec with send_message(EVENT, body).
+    """
+    payload_type, payload_bytes = encode_payload(payload, codec)
+    event_bytes = event.encode('utf-8')
+    return EVENT_HEADER.pack(payload_type, len(event_bytes)) + event_bytes + payload_bytes
+
+
+def unpack_event(body, codec=None):
+    """
+    Returns (event name, payload) of an event body.
+    """
+    payload_type, event_length = EVENT_HEADER.unpack_from(body)
+    event_end = EVENT_HEADER.size + event_length
+    event = str(body[EVENT_HEADER.size:event_end], 'utf-8')
+    return event, decode_payload(payload_type, body[event_end:], codec)
+
+
+class FramedSocket:
+    """
+    Send and receive framed messages over a connected TCP socket.
+
+    Bodies are read with recv_into into a buffer that is allocated once and only
+    replaced by a larger one, recv_message returns a memoryview into that buffer
+    which stays valid until the next call.
+    Once start_session is called every body is encrypted with the session key.
+    A header announcing a body over max_message_size is refused before anything is allocated for it.
+    Sending is thread-safe so events can be pushed while another thread answers requests.
+    Payloads are compressed with codec once the peers agreed on one.
+    """
+
+    def __init__(self, sock, buffer_size=4096):
+        self.sock = sock
+        self.header = bytearray(HEADER.size)
+        self.buffer = bytearray(buffer_size)
+        self.cipher = None
+        self.codec = None
+        self.send_lock = threading.Lock()
+        self.max_message_size = MAX_HANDSHAKE_MESSAGE_SIZE
+        # Server side: the session ticket of the connection and the user logged in on it
+        self.session_ticket = None
+        self.username = None
+
+    def start_session(self, key, server=False):
+        self.cipher = SessionCipher(key, server)
+        self.max_message_size = MAX_MESSAGE_SIZE
+
+    def recv_into_exactly(self, view):
+        """
+        Fill the whole view from the socket.
+        """
+        received = 0
+        while received < len(view):
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError("Connection closed by peer")
+            received += count
+
+    def recv_message(self):
+        """
+        Receive one message, returns (message type, memoryview of the body).
+        """
+        self.recv_into_exactly(memoryview(self.header))
+        length, msg_type = HEADER.unpack(self.header)
+        check_length(length, self.max_message_size)
+
+        if length > len(self.buffer):
+            # Views handed out earlier keep the old buffer alive, so replace it instead of resizing
+            self.buffer = bytearray(max(length, min(2 * len(self.buffer), self.max_message_size)))
+
+        body = memoryview(self.buffer)[:length]
+        self.recv_into_exactly(body)
+        if self.cipher:
+            body = memoryview(self.cipher.decrypt(msg_type, body))
+        return msg_type, body
+
+    def recv_expected(self, expected_type):
+        msg_type, body = self.recv_message()
+        if msg_type != expected_type:
+            raise ProtocolError(f"Expected message type {expected_type}, got {msg_type}")
+        return body
+
+    def recv_text(self):
+        return str(self.recv_expected(TEXT), 'utf-8')
+
+    def recv_json(self):
+        return decode_json(self.recv_expected(JSON))
+
+    def recv_bytes(self):
+        return bytes(self.recv_expected(BYTES))
+
+    def recv_request(self):
+        return unpack_request(self.recv_expected(REQUEST), self.codec)
+
+    def recv_response(self):
+        return unpack_response(self.recv_expected(RESPONSE), self.codec)
+
+    def send_message(self, msg_type, body):
+        with self.send_lock:
+            # Encrypted under the lock, the sequence numbers must go out in order
+            if self.cipher:
+                body = self.cipher.encrypt(msg_type, body)
+            self.sock.sendall(pack_message(msg_type, body))
+
+    def send_text(self, text):
+        self.send_message(TEXT, text.encode('utf-8'))
+
+    def send_json(self, data):
+        self.send_message(JSON, encode_json(data))
+
+    def send_bytes(self, data):
+        self.send_message(BYTES, data)
+
+    def send_request(self, request_id, action, payload):
+        self.send_message(REQUEST, pack_request(request_id, action, payload, self.codec))
+
+    def send_response(self, request_id, payload):
+        self.send_message(RESPONSE, pack_response(request_id, payload, self.codec))
+
+    def close(self):
+        self.sock.close()
+
+
+class AsyncFramedStream:
+    """
+    Coroutine version of FramedSocket on top of an asyncio StreamReader / StreamWriter pair.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.cipher = None
+        self.codec = None
+        self.max_message_size = MAX_HANDSHAKE_MESSAGE_SIZE
+        self.session_ticket = None
+        self.username = None
+
+    def start_session(self, key, server=False):
+        self.cipher = SessionCipher(key, server)
+        self.max_message_size = MAX_MESSAGE_SIZE
+
+    async def recv_message(self):
+        length, msg_type = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+        check_length(length, self.max_message_size)
+        body = await self.reader.readexactly(length)
+        if self.cipher:
+            body = self.cipher.decrypt(msg_type, body)
+        return msg_type, body
+
+    async def recv_expected(self, expected_type):
+        msg_type, body = await self.recv_message()
+        if msg_type != expected_type:
+            raise ProtocolError(f"Expected message type {expected_type}, got {msg_type}")
+        return body
+
+    async def recv_text(self):
+        return (await self.recv_expected(TEXT)).decode('utf-8')
+
+    async def recv_json(self):
+        return decode_json(await self.recv_expected(JSON))
+
+    async def recv_bytes(self):
+        return await self.recv_expected(BYTES)
+
+    async def recv_request(self):
+        return unpack_request(await self.recv_expected(REQUEST), self.codec)
+
+    async def recv_response(self):
+        return unpack_response(await self.recv_expected(RESPONSE), self.codec)
+
+    def write_message(self, msg_type, body):
+        """
+        Queue a message on the transport without waiting for it to be flushed (event fan-out).
+        """
+        if self.cipher:
+            body = self.cipher.encrypt(msg_type, body)
+        self.writer.write(pack_message(msg_type, body))
+
+    def pending_bytes(self):
+        """Bytes written to the transport that the peer has not taken yet"""
+        return self.writer.transport.get_write_buffer_size()
+
+    async def send_message(self, msg_type, body):
+        self.write_message(msg_type, body)
+        await self.writer.drain()
+
+    async def send_text(self, text):
+        await self.send_message(TEXT, text.encode('utf-8'))
+
+    async def send_json(self, data):
+        await self.send_message(JSON, encode_json(data))
+
+    async def send_bytes(self, data):
+        await self.send_message(BYTES, data)
+
+    async def send_request(self, request_id, action, payload):
+        await self.send_message(REQUEST, pack_request(request_id, action, payload, self.codec))
+
+    async def send_response(self, request_id, payload):
+        await self.send_message(RESPONSE, pack_response(request_id, payload, self.codec))
+
+    def close(self):
+        self.writer.close()
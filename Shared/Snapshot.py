@@ -0,0 +1,136 @@
+import struct
+from collections import OrderedDict
+
+# A snapshot packet: (packet type, sequence, baseline sequence) then the counts of changed and removed
+# players, each changed player is a length-prefixed UTF-8 username with its position, each removed one
+# only its username. Baseline sequence 0 means a full snapshot.
+SNAPSHOT = 1
+HEADER = struct.Struct('!BII')
+COUNTS = struct.Struct('!HH')
+POSITION = struct.Struct('!ii')
+HISTORY_SIZE = 32  # Snapshots remembered on each side, older baselines get a full snapshot
+MAX_USERNAME_SIZE = 255  # UTF-8 bytes, the length prefix is one byte
+MAX_PACKET_SIZE = 1200  # Snapshots stay under a typical MTU, so they are neither fragmented nor refused by sendto
+
+
+def is_snapshot(data):
+    return len(data) >= HEADER.size and data[0] == SNAPSHOT
+
+
+def pack_username(username):
+    encoded = username.encode('utf-8')
+    return bytes((len(encoded),)) + encoded
+
+
+def entry_size(username):
+    return 1 + len(username.encode('utf-8')) + POSITION.size
+
+
+def nearest_that_fit(players, center_x, center_y, max_size=MAX_PACKET_SIZE):
+    """
+    The players (username -> (pos_x, pos_y)) nearest to (center_x, center_y) whose full snapshot fits in max_size bytes.
+    """
+    budget = max_size - HEADER.size - COUNTS.size
+    sizes = {username: entry_size(username) for username in players}
+    if sum(sizes.values()) <= budget:
+        return players
+
+    def distance(username):
+        pos_x, pos_y = players[username]
+        return (pos_x - center_x) ** 2 + (pos_y - center_y) ** 2
+
+    nearest = {}
+    for username in sorted(players, key=distance):
+        budget -= sizes[username]
+        if budget < 0:
+            break
+        nearest[username] = players[username]
+    return nearest
+
+
+def pack_delta(sequence, baseline_sequence, baseline, players):
+    """
+    Pack the players (username -> (pos_x, pos_y)) that joined or moved since baseline,
+    and the ones that left, baseline being the players of snapshot baseline_sequence.
+    """
+    changed = [(username, position) for username, position in players.items()
+               if baseline.get(username) != position]
+    removed = [username for username in baseline if username not in players]
+
+    parts = [HEADER.pack(SNAPSHOT, sequence, baseline_sequence), COUNTS.pack(len(changed), len(removed))]
+    for username, (pos_x, pos_y) in changed:
+        parts.append(pack_username(username))
+        parts.append(POSITION.pack(pos_x, pos_y))
+    for username in removed:
+        parts.append(pack_username(username))
+    return b''.join(parts)
+
+
+def pack_view(sequence, baseline_sequence, baseline, players, center_x, center_y, max_size=MAX_PACKET_SIZE):
+    """
+    The packet a client gets for the players in its view: the nearest ones to (center_x, center_y) that fit in
+    max_size, as a delta from baseline, or as a full snapshot when the removals make the delta bigger.
+    Returns (packet, the players it holds).
+    """
+    players = nearest_that_fit(players, center_x, center_y, max_size)
+    packet = pack_delta(sequence, baseline_sequence, baseline, players)
+    if len(packet) > max_size:
+        # A full snapshot of these players always fits
+        packet = pack_delta(sequence, 0, {}, players)
+    return packet, players
+
+
+def unpack_username(data, offset):
+    length = data[offset]
+    start = offset + 1
+    return data[start:start + length].decode('utf-8'), start + length
+
+
+def unpack_delta(data):
+    """
+    Returns (sequence, baseline sequence, changed players dict, removed usernames).
+    """
+    _, sequence, baseline_sequence = HEADER.unpack_from(data)
+    num_changed, num_removed = COUNTS.unpack_from(data, HEADER.size)
+    offset = HEADER.size + COUNTS.size
+
+    changed = {}
+    for _ in range(num_changed):
+        username, offset = unpack_username(data, offset)
+        changed[username] = POSITION.unpack_from(data, offset)
+        offset += POSITION.size
+
+    removed = []
+    for _ in range(num_removed):
+        username, offset = unpack_username(data, offset)
+        removed.append(username)
+    return sequence, baseline_sequence, changed, removed
+
+
+def apply_delta(baseline, changed, removed):
+    """
+    Return the players of a snapshot from its baseline and the unpacked delta.
+    """
+    players = dict(baseline)
+    players.update(changed)
+    for username in removed:
+        players.pop(username, None)
+    return players
+
+
+class SnapshotHistory:
+    """
+    The last HISTORY_SIZE snapshots (sequence -> players) sent or received.
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.snapshots = OrderedDict()
+
+    def add(self, sequence, players):
+        self.snapshots[sequence] = players
+        while len(self.snapshots) > self.size:
+            self.snapshots.popitem(last=False)
+
+    def get(self, sequence):
+        return self.snapshots.get(sequence)
@@ -0,0 +1,83 @@
+class SpatialGrid:
+    """
+    Uniform grid that buckets items by the cell containing their (x, y) position.
+    Moving, removing and finding the items inside a rectangle only touch the cells involved,
+    so their cost does not grow with the total number of items.
+    """
+
+    def __init__(self, cell_size=512):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell_x, cell_y) -> set of items
+        self.positions = {}  # item -> (x, y)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def cell_of(self, x, y):
+        return int(x) // self.cell_size, int(y) // self.cell_size
+
+    def move(self, item, x, y):
+        """
+        Insert an item or update its position.
+        """
+        cell = self.cell_of(x, y)
+        old_position = self.positions.get(item)
+        if old_position is not None:
+            old_cell = self.cell_of(*old_position)
+            if old_cell != cell:
+                self.remove_from_cell(item, old_cell)
+                self.cells.setdefault(cell, set()).add(item)
+        else:
+            self.cells.setdefault(cell, set()).add(item)
+        self.positions[item] = (x, y)
+
+    insert = move
+
+    def remove(self, item):
+        """
+        Remove an item, returns False if it was not in the grid.
+        """
+        position = self.positions.pop(item, None)
+        if position is None:
+            return False
+        self.remove_from_cell(item, self.cell_of(*position))
+        return True
+
+    def remove_from_cell(self, item, cell):
+        items = self.cells[cell]
+        items.discard(item)
+        if not items:
+            del self.cells[cell]
+
+    def query_rect(self, left, top, right, bottom):
+        """
+        Yield the items whose position is inside the rectangle (edges included).
+        A rectangle covering more cells than are occupied goes over the occupied cells instead,
+        so a huge rectangle costs no more than looking at every item.
+        """
+        first_x, first_y = self.cell_of(left, top)
+        last_x, last_y = self.cell_of(right, bottom)
+        if last_x < first_x or last_y < first_y:
+            return
+        if (last_x - first_x + 1) * (last_y - first_y + 1) > len(self.cells):
+            cells = [items for (cell_x, cell_y), items in self.cells.items()
+                     if first_x <= cell_x <= last_x and first_y <= cell_y <= last_y]
+        else:
+            cells = [self.cells.get((cell_x, cell_y), ()) for cell_x in range(first_x, last_x + 1)
+                     for cell_y in range(first_y, last_y + 1)]
+        positions = self.positions
+        for items in cells:
+            for item in items:
+                x, y = positions[item]
+                if left <= x <= right and top <= y <= bottom:
+                    yield item
+
+    def query_view(self, center_x, center_y, width, height):
+        """
+        Yield the items inside a width x height view centred on (center_x, center_y).
+        """
+        return self.query_rect(center_x - width / 2, center_y - height / 2,
+                               center_x + width / 2, center_y + height / 2)
@@ -0,0 +1,252 @@
+import bisect
+import struct
+import sys
+from array import array
+
+# Stories on the wire as columns: a header (number of stories, number of strings), the int32 columns
+# ids, versions, pos_x, pos_y, titles, contents and usernames (the last three are indexes into the string
+# table), then the string table with every string UTF-8 encoded after its length. Integers are little-endian.
+HEADER = struct.Struct('<II')
+LENGTH = struct.Struct('<I')
+INT_COLUMNS = ('ids', 'versions', 'pos_x', 'pos_y')
+STRING_COLUMNS = ('titles', 'contents', 'usernames')
+
+# A receive_stories response: (store version, next after_id or 0, number of deleted ids),
+# the deleted ids as int32, then the stories as columns
+RESPONSE_HEADER = struct.Struct('<III')
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def is_int32(value):
+    return type(value) is int and INT32_MIN <= value <= INT32_MAX
+
+
+def is_valid_story(title, content, username, pos_x, pos_y):
+    """
+    True if the fields of a story fit the columns: strings, and positions that are int32.
+    """
+    return (isinstance(title, str) and isinstance(content, str) and isinstance(username, str)
+            and is_int32(pos_x) and is_int32(pos_y))
+
+
+def column_bytes(column):
+    """
+    The little-endian bytes of an int32 array, a plain copy on little-endian machines.
+    """
+    if sys.byteorder == 'big':
+        column = array('i', column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def column_from_bytes(data):
+    column = array('i')
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+class StringTable:
+    """
+    Interned strings, each one is stored once and referred to by its index.
+    The wire encoding of the table is kept up to date as strings are added, strings nothing refers to
+    anymore are counted as garbage until the table is rebuilt (StoryColumns.compact).
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.indexes = {}  # string -> index
+        self.references = []  # index -> number of cells referring to the string
+        self.garbage = 0  # strings with no references left
+        self.encoded = bytearray()
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, string):
+        index = self.indexes.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(string)
+            self.indexes[string] = index
+            self.references.append(0)
+            encoded = string.encode('utf-8')
+            self.encoded += LENGTH.pack(len(encoded))
+            self.encoded += encoded
+        elif self.references[index] == 0:
+            self.garbage -= 1
+        self.references[index] += 1
+        return index
+
+    def release(self, index):
+        """
+        Drop one reference to a string.
+        """
+        self.references[index] -= 1
+        if self.references[index] == 0:
+            self.garbage += 1
+
+
+class StoryColumns:
+    """
+    Stories kept as columns: ids, versions and positions in int32 arrays, titles, contents
+    and usernames as indexes into an interned string table. Rows are kept in id order.
+    """
+
+    def __init__(self):
+        self.ids = array('i')
+        self.versions = array('i')
+        self.pos_x = array('i')
+        self.pos_y = array('i')
+        self.titles = array('i')
+        self.contents = array('i')
+        self.usernames = array('i')
+        self.strings = StringTable()
+
+    @classmethod
+    def from_entries(cls, entries):
+        columns = cls()
+        for entry in entries:
+            columns.append(entry)
+        return columns
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, entry):
+        """
+        Add a story (dict with id, version, title, content, username, pos_x and pos_y), its id must be
+        greater than the ids already stored.
+        """
+        self.ids.append(entry['id'])
+        self.versions.append(entry.get('version', entry['id']))
+        self.pos_x.append(entry['pos_x'])
+        self.pos_y.append(entry['pos_y'])
+        self.titles.append(self.strings.intern(entry['title']))
+        self.contents.append(self.strings.intern(entry['content']))
+        self.usernames.append(self.strings.intern(entry['username']))
+
+    def index_of(self, story_id):
+        """
+        Row of a story, None if there is no such story.
+        """
+        index = bisect.bisect_left(self.ids, story_id)
+        if index < len(self.ids) and self.ids[index] == story_id:
+            return index
+        return None
+
+    def remove(self, story_id):
+        """
+        Remove a story, returns False if there is no such story. Its strings stay in the table until
+        the table is compacted, which happens once they are most of it and before every pack.
+        """
+        index = self.index_of(story_id)
+        if index is None:
+            return False
+        for name in STRING_COLUMNS:
+            self.strings.release(getattr(self, name)[index])
+        for name in INT_COLUMNS + STRING_COLUMNS:
+            del getattr(self, name)[index]
+        if self.strings.garbage > len(self.strings) // 2:
+            self.compact()
+        return True
+
+    def compact(self):
+        """
+        Rebuild the string table from the strings the rows still refer to.
+        """
+        strings = self.strings.strings
+        table = StringTable()
+        for name in STRING_COLUMNS:
+            setattr(self, name, array('i', [table.intern(strings[index]) for index in getattr(self, name)]))
+        self.strings = table
+
+    def row(self, index):
+        strings = self.strings.strings
+        return {
+            "id": self.ids[index],
+            "title": strings[self.titles[index]],
+            "content": strings[self.contents[index]],
+            "username": strings[self.usernames[index]],
+            "pos_x": self.pos_x[index],
+            "pos_y": self.pos_y[index],
+            "version": self.versions[index]
+        }
+
+    def rows(self, start=0, end=None):
+        return [self.row(index) for index in range(start, len(self.ids) if end is None else end)]
+
+    def column(self, name):
+        """
+        The values of a column as a list, strings resolved.
+        """
+        if name in STRING_COLUMNS:
+            strings = self.strings.strings
+            return [strings[index] for index in getattr(self, name)]
+        return getattr(self, name).tolist()
+
+    def pack(self):
+        """
+        The wire encoding of every story: the columns and the string table are copied as they are,
+        after dropping the strings of removed stories so they never reach the wire.
+        """
+        if self.strings.garbage:
+            self.compact()
+        parts = [HEADER.pack(len(self.ids), len(self.strings))]
+        parts.extend(column_bytes(getattr(self, name)) for name in INT_COLUMNS + STRING_COLUMNS)
+        parts.append(self.strings.encoded)
+        return b''.join(parts)
+
+
+def pack_entries(entries):
+    """
+    The wire encoding of some stories (dicts), with a string table of only their strings.
+    """
+    return StoryColumns.from_entries(entries).pack()
+
+
+def unpack(data):
+    """
+    Decode the columns into a dict of lists (ids, versions, pos_x, pos_y, titles, contents, usernames),
+    the shape of a JSON receive_stories response.
+    """
+    data = memoryview(data)
+    count, num_strings = HEADER.unpack_from(data)
+    offset = HEADER.size
+    columns = {}
+    for name in INT_COLUMNS + STRING_COLUMNS:
+        columns[name] = column_from_bytes(data[offset:offset + 4 * count]).tolist()
+        offset += 4 * count
+
+    strings = []
+    for _ in range(num_strings):
+        (length,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        strings.append(str(data[offset:offset + length], 'utf-8'))
+        offset += length
+    for name in STRING_COLUMNS:
+        columns[name] = [strings[index] for index in columns[name]]
+    return columns
+
+
+def pack_response(stories, deleted, version, next_after_id):
+    """
+    A columnar receive_stories response, stories being the packed columns.
+    """
+    return b''.join((RESPONSE_HEADER.pack(version, next_after_id or 0, len(deleted)),
+                     column_bytes(array('i', deleted)), stories))
+
+
+def unpack_response(data):
+    """
+    Decode a columnar receive_stories response into the dict a JSON one would be.
+    """
+    data = memoryview(data)
+    version, next_after_id, num_deleted = RESPONSE_HEADER.unpack_from(data)
+    offset = RESPONSE_HEADER.size
+    response = unpack(data[offset + 4 * num_deleted:])
+    response['deleted'] = column_from_bytes(data[offset:offset + 4 * num_deleted]).tolist()
+    response['version'] = version
+    response['next_after_id'] = next_after_id or None
+    return response